@@ -2,16 +2,17 @@
 
 This script runs a domain against 2 different 3rd party tools: WhoisXMLAPI Domain Reputation API and IPQUALITYSCORE IP Reputation Check API.  
 
-This script has two functions, one for each different API call. Both take just a domain in string form and print out the result of the API call in a json file.
+This script has two functions, one for each different API call. Both take just a domain in string form, save the result of the API call in the verdict store (see verdict_store.py) and return it. A domain checked recently is not requested again, its stored result is returned.
 
-There is also a check function to run a domain against both API.
+There is also a check function to run a domain against both API. To run the lookups of several providers in parallel and merge their verdicts, see reputation_engine.py.
 """
 
 import requests
 import json
 import env
+from verdict_store import get_verdict_store, get_max_age
 
-def make_secure_api_call(url, headers = {}) -> str:
+def make_secure_api_call(url, headers = {}, timeout = None) -> str:
     """ Make API call with error handling
 
     Parameters
@@ -20,9 +21,11 @@ def make_secure_api_call(url, headers = {}) -> str:
         The url to make the api call
     headers: dict
         The headers used in the api call
+    timeout: float
+        Seconds to wait for an answer, no limit by default
     """
     try:
-        response = requests.get(url, headers = headers)
+        response = requests.get(url, headers = headers, timeout = timeout)
         if response.status_code == 429:
             print("You have exceeded the number of API calls allowed for your account")
     except requests.exceptions.RequestException as e:
@@ -30,48 +33,70 @@ def make_secure_api_call(url, headers = {}) -> str:
 
     return response
 
-def whoisxml_domain_reputation(domain):
-    """ Checks the domain against the WhoisXMLAPI Domain Reputation API and saves the result in a json file
+def whoisxml_domain_reputation(domain, timeout = None):
+    """ Checks the domain against the WhoisXMLAPI Domain Reputation API, saves the result in the verdict store and returns it
     
     Parameters
     ----------
     domain: str
         The domain you are checking, works with URL and IP address
+    timeout: float
+        Seconds to wait for an answer, no limit by default
     
     """
+    # Use the stored verdict if the domain has been checked recently
+    store = get_verdict_store()
+    result = store.latest("whoisxml", domain, get_max_age())
+    if result is not None:
+        return result
+
     # Gets API key and Baseurl for API call from env.py file
     apikey = env.WHOISXML.get("apiKey")
     base_url = env.WHOISXML.get("base_url")
 
     # API call to WhoisXML with domain
     url = f"{base_url}/?apiKey={apikey}&domainName={domain}"
-    response = make_secure_api_call(url)
+    response = make_secure_api_call(url, timeout = timeout)
+    result = response.json()
+
+    # Save domain reputation verdict in the verdict store
+    if response.status_code == 200:
+        store.add("whoisxml", domain, result)
 
-    # Save domain reputation verdict as a json file
-    with open(f"whois_{domain}.json", 'w', encoding='utf-8') as f:
-        json.dump(response.json(), f, ensure_ascii=False, indent=4)
+    return result
 
 
-def ip_quality_score(domain):
-    """ Checks the domain against the IPQUALITYSCORE IP Reputation Check API and saves the result in a json file
+def ip_quality_score(domain, timeout = None):
+    """ Checks the domain against the IPQUALITYSCORE IP Reputation Check API, saves the result in the verdict store and returns it
     
     Parameters
     ----------
     domain: str
         The domain you are checking, works with URL and IP address
+    timeout: float
+        Seconds to wait for an answer, no limit by default
     
     """
+    # Use the stored verdict if the domain has been checked recently
+    store = get_verdict_store()
+    result = store.latest("ipqualityscore", domain, get_max_age())
+    if result is not None:
+        return result
+
     # Gets API key and Baseurl for API call from env.py file
     apikey = env.IPQUALITYSCORE.get("apiKey")
     base_url = env.IPQUALITYSCORE.get("base_url")
 
     # API call to IPQUALITYSCORE with domain
     url = f"{base_url}/{apikey}/{domain}"
-    response = make_secure_api_call(url)  
+    response = make_secure_api_call(url, timeout = timeout)  
+    result = response.json()
 
-    # Save IP reputation verdict as a json file
-    with open(f"ipscore_{domain}.json", 'w', encoding='utf-8') as f:
-        json.dump(response.json(), f, ensure_ascii=False, indent=4)
+    # Save IP reputation verdict in the verdict store
+    if response.status_code == 200:
+        store.add("ipqualityscore", domain, result)
+
+    return result
 
 
 def check(domain):
@@ -88,9 +113,11 @@ def check(domain):
     ip_quality_score(domain)
 
 
-testurl = "google.com"
-testip = "69.63.181.11" #Facebook IP address
-check(testurl)
-check(testip)
+if __name__ == "__main__":
+    testurl = "google.com"
+    testip = "69.63.181.11" #Facebook IP address
+    check(testurl)
+    check(testip)
+
 
 
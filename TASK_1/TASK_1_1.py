@@ -21,26 +21,36 @@ import json
 from retrieve_urls import retrieve_urls
 from get_DNS_queries import get_DNS_queries
 from push_it_all import push_it_all
+from domains_store import get_domains_store
+from flow_scan import commit_pending
 
-# MAIN
-print("Starting the code...")
+## FUNCTION
+# Runs the whole process, only when the script is executed (importing it does nothing)
+def main():
+    print("Starting the code...")
 
-# This function retrieves the complete list of requested domains, with their
-# associated IP and date when this ocurred
-retrieve_urls()
-print("Step 1/4: Domains have been retrieved successfully.")
+    # This function retrieves the complete list of requested domains, with their
+    # associated IP and date when this ocurred
+    retrieve_urls()
+    print("Step 1/4: Domains have been retrieved successfully.")
 
-# This function reads the content inside domains_urls.json and stores it into
-# a Python dictionary
-domains_list = get_DNS_queries()
-print("Step 2/4: Domains have been obtained successfully from JSON file.")
+    # This function reads the content inside domains_urls.json and stores it into
+    # a Python dictionary
+    domains_list = get_DNS_queries()
+    print("Step 2/4: Domains have been obtained successfully from JSON file.")
 
-# Get information from the Database of domains
-file = open('domains_DB.json',)
-domains_DB = json.load(file)
-print("Step 3/4: Information has been successfully obtained from DB.")
+    # Get information from the Database of domains
+    domains_DB = get_domains_store()
+    print("Step 3/4: Information has been successfully obtained from DB.")
 
-# This function processes the requests made previously, and pushes them into
-# CV if necessary
-push_it_all(domains_list, domains_DB)
-print("Step 4/4: New domains have been successfully processed and pushed to CV.")
\ No newline at end of file
+    # This function processes the requests made previously, and pushes them into
+    # CV if necessary
+    push_it_all(domains_list, domains_DB)
+
+    # The DNS records of the scan are only removed once they have been processed
+    commit_pending('dns')
+    print("Step 4/4: New domains have been successfully processed and pushed to CV.")
+
+
+if __name__ == "__main__":
+    main()
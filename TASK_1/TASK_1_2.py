@@ -28,44 +28,55 @@ days from the current date.
 import json
 from get_DNS_queries import get_DNS_queries
 from push_it_all import push_it_all
+from domains_store import get_domains_store
 from get_cv_ip import get_ips
 from ip_get_domain import umbrella_ip_to_dom
+from flow_scan import commit_pending
 
-# MAIN
-print("Starting the code...")
+## FUNCTION
+# Runs the whole process, only when the script is executed (importing it does nothing)
+def main():
+    print("Starting the code...")
 
-# This function retrieves a list of public addresses witnessed by CV 
-# and the date when this occurred.
-public_ips = get_ips()
-print("Step 1/4: IPv4 address gathering for the defined period has been completed.")
+    # This function retrieves a list of public addresses witnessed by CV 
+    # and the date when this occurred.
+    public_ips = get_ips()
+    print("Step 1/4: IPv4 address gathering for the defined period has been completed.")
 
-# This function searches the umbrella database for malicious domains 
-# associated with the public addresses retrieved by the previous function.
-malicious_domains = umbrella_ip_to_dom(public_ips)
-domains_list = []
+    # This function searches the umbrella database for malicious domains 
+    # associated with the public addresses retrieved by the previous function.
+    malicious_domains = umbrella_ip_to_dom(public_ips)
+    domains_list = []
 
-for a in malicious_domains:
-    for b in a['domains']:
-        domains_list.append(
-            {
-                'domain' : b, 
-                'IP' : a['IP'], 
-                'time' : a['time']
-            }
-        )
+    for a in malicious_domains:
+        for b in a['domains']:
+            domains_list.append(
+                {
+                    'domain' : b, 
+                    'IP' : a['IP'], 
+                    'time' : a['time']
+                }
+            )
 
-print("Step 2/4: The domain search has been completed.")
-if len(domains_list) == 0:
-    print("No malicious domains found, no further action needed.")
-    print("Program complete.")
-else:
-    # Get information from the Database of domains
-    file = open('domains_DB.json',)
-    domains_DB = json.load(file)
-    print("Step 3/4: Information has been successfully obtained from DB.")
+    print("Step 2/4: The domain search has been completed.")
+    if len(domains_list) == 0:
+        print("No malicious domains found, no further action needed.")
+        print("Program complete.")
+    else:
+        # Get information from the Database of domains
+        domains_DB = get_domains_store()
+        print("Step 3/4: Information has been successfully obtained from DB.")
 
-    # This function processes the requests made previously, and pushes
-    # them into CV if necessary
-    push_it_all(domains_list, domains_DB)
-    print("Step 4/4: The new malicious domains have been successfully processed and pushed to CV.")
-    print("Program complete.")
+        # This function processes the requests made previously, and pushes
+        # them into CV if necessary
+        push_it_all(domains_list, domains_DB)
+        print("Step 4/4: The new malicious domains have been successfully processed and pushed to CV.")
+        print("Program complete.")
+
+    # The public IPs of the scan are only removed once they have been processed, the ones that could not be checked
+    # are already back in the pending file (see ip_get_domain.py)
+    commit_pending('ips')
+
+
+if __name__ == "__main__":
+    main()
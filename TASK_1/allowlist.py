@@ -0,0 +1,157 @@
+"""
+Copyright (c) 2021 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+"""
+Local allowlist of well-known domains, checked before any reputation
+lookup.
+The allowlist is a text file with one domain per line (a "rank,domain"
+csv, such as the popular domain lists, is accepted too). It is compiled
+once into a binary file holding the sorted 64-bit hashes of the
+domains, 8 bytes per domain, which is memory-mapped and searched with a
+binary search, so a list of millions of domains is neither parsed nor
+loaded in memory on every run. The compiled file is rebuilt when the
+text file changes.
+A domain is allowed if it, or any of its parent domains, is in the
+list: "www.google.com" is allowed by "google.com".
+- Allowlist: the compiled allowlist, with the number of domains checked
+    and allowed.
+- compile_allowlist: compiles a text file into the binary format.
+- get_allowlist: returns the allowlist configured in the env file, None
+    if it is disabled.
+"""
+
+import hashlib
+import mmap
+import os
+import threading
+from array import array
+from bisect import bisect_left
+
+import env
+
+settings = getattr(env, "ALLOWLIST", {})
+
+
+def domain_hash(domain):
+    """
+    64-bit hash of a domain, lowercase and without the trailing dot.
+    """
+    name = domain.strip().rstrip(".").lower().encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(name, digest_size=8).digest(), "little")
+
+
+def compile_allowlist(source, compiled):
+    """
+    Compiles a text file of domains into a file of sorted, unique 64-bit
+    hashes. Blank lines and lines starting with # are skipped.
+    Returns the number of domains.
+    """
+    hashes = set()
+    with open(source, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            # "rank,domain" csv files
+            domain = line.split(",")[-1]
+            if domain:
+                hashes.add(domain_hash(domain))
+
+    table = array("Q", sorted(hashes))
+    tmp = compiled + ".tmp"
+    with open(tmp, "wb") as f:
+        table.tofile(f)
+    os.replace(tmp, compiled)
+    return len(table)
+
+
+class Allowlist:
+    """
+    A compiled allowlist, memory-mapped.
+    Parameters: path of the compiled file (see compile_allowlist).
+    """
+
+    def __init__(self, path):
+        self.checked = 0
+        self.allowed = 0
+        self.file = open(path, "rb")
+        if os.path.getsize(path) == 0:
+            self.map = None
+            self.hashes = []
+        else:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.hashes = memoryview(self.map).cast("Q")
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def contains(self, domain):
+        """
+        Is this exact domain in the list?
+        """
+        value = domain_hash(domain)
+        i = bisect_left(self.hashes, value)
+        return i < len(self.hashes) and self.hashes[i] == value
+
+    def is_allowed(self, domain):
+        """
+        Is the domain, or one of its parent domains, in the list? Top
+        level domains alone ("com") are never matched.
+        """
+        self.checked += 1
+        labels = domain.strip().rstrip(".").lower().split(".")
+        for i in range(len(labels) - 1):
+            if self.contains(".".join(labels[i:])):
+                self.allowed += 1
+                return True
+        return False
+
+    def filter(self, domains):
+        """
+        Returns the domains that are not allowed, in the same order.
+        """
+        return [domain for domain in domains if not self.is_allowed(domain)]
+
+    def print_stats(self):
+        print("Allowlist: " + str(self.checked) + " domains checked, " + str(self.allowed)
+              + " allowed without any reputation lookup")
+
+
+_allowlist = None
+_lock = threading.Lock()
+
+
+def get_allowlist():
+    """
+    Returns the allowlist configured in the env file (ALLOWLIST), compiling
+    it first if the text file is newer than the compiled one. Returns None
+    if it is disabled or the text file does not exist.
+    """
+    global _allowlist
+    with _lock:
+        if _allowlist is None:
+            if not settings.get("enabled", True):
+                return None
+            source = settings.get("file", "allowlist.txt")
+            compiled = settings.get("compiled_file", "allowlist.bin")
+            if not os.path.exists(source):
+                return None
+            if not os.path.exists(compiled) or os.path.getmtime(compiled) < os.path.getmtime(source):
+                count = compile_allowlist(source, compiled)
+                print("Allowlist compiled: " + str(count) + " domains")
+            _allowlist = Allowlist(compiled)
+        return _allowlist
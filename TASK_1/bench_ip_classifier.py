@@ -0,0 +1,141 @@
+"""
+Copyright (c) 2021 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+"""
+Microbenchmark of the IP classification used by the flow scan.
+Compares the previous string-prefix version of isItPublic (kept below
+for reference) with the precompiled tables of ip_classifier.py, on a
+random mix of public, private, reserved and IPv6 addresses, and lists
+the addresses on which the two versions disagree.
+Run it with: python3 bench_ip_classifier.py [number of addresses]
+"""
+
+import random
+import sys
+import timeit
+
+from ip_classifier import is_public, classify_public
+
+
+def legacy_isItPublic(stringIp):
+    """ 
+    Is this IP address public?
+    Parameters: string IP address of format "0.0.0.0" - "255.255.255.255"
+    If IPv4, public, and not reserved return True, else return False.
+    """
+    # Private IPs
+    if stringIp[0:3] == "10.":
+        return False
+    for i in range(16, 32):
+        check = "172." + str(i) + "."
+        if stringIp[0:7] == check:
+            return False
+    if stringIp[0:8] == "192.168.":
+        return False
+    # Current networks / Source addresses.
+    if stringIp[0] == "0":
+        return False
+    # Shared address space for SP to subscribers through carrier-grade NAT.
+    for i in range(64, 128):
+        check = "100." + str(i) + "."
+        if i < 100:
+            if stringIp[0:7] == check:
+                return False
+        else:
+            if stringIp[0:8] == check:
+                return False
+    # Loopback addresses to local host.
+    if stringIp[0:3] == "127":
+        return False
+    # Link-local addresses between two hosts on a single link when no 
+    # IP address is specified.
+    if stringIp[0:7] == "169.254":
+        return False
+    # IETF protocol assignments.
+    if stringIp[0:7] == "192.0.0":
+        return False
+    # TEST-NET-1 documentation and examples.
+    if stringIp[0:7] == "192.0.2":
+        return False
+    # Reserved 6to4 Relay Anycast.
+    if stringIp[0:9] == "192.88.99":
+        return False
+    # Network Interconnect Device Benchmark Testing.
+    for i in range(18, 20):
+        check = "198." + str(i) + "."
+        if stringIp[0:7] == check:
+            return False
+    # TEST-NET-2
+    if stringIp[0:11] == "198.51.100.":
+        return False
+    # TEST-NET-3
+    if stringIp[0:10] == "203.0.113.":
+        return False
+    # Reserved for future use.
+    for i in range(40, 56):
+        check = "2" + str(i) + "."
+        if stringIp[0:4] == check:
+            return False
+    # Broadcast IP.
+    if stringIp[0:15] == "255.255.255.255":
+        return False
+    # Disallow IPv6 as the proceeding workflows are not compatible.
+    for p in stringIp:
+        if p == ":":
+            return False
+    # The address may be passed to the proceeding function.
+    return True
+
+
+
+def sample_addresses(n, seed=1):
+    """
+    Returns n random addresses, a third of them inside reserved blocks.
+    """
+    rng = random.Random(seed)
+    prefixes = ["10.", "172.16.", "192.168.", "100.64.", "127.", "169.254.",
+                "192.0.2.", "198.18.", "203.0.113.", "240."]
+    addresses = []
+    for i in range(n):
+        kind = i % 6
+        if kind < 3:
+            addresses.append(".".join(str(rng.randint(0, 255)) for _ in range(4)))
+        elif kind < 5:
+            prefix = rng.choice(prefixes)
+            missing = 4 - prefix.count(".")
+            addresses.append(prefix + ".".join(str(rng.randint(0, 255)) for _ in range(missing)))
+        else:
+            addresses.append("2001:db8::" + format(rng.randint(0, 65535), "x"))
+    return addresses
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    addresses = sample_addresses(n)
+
+    timings = {
+        "legacy isItPublic": lambda: [legacy_isItPublic(ip) for ip in addresses],
+        "is_public": lambda: [is_public(ip) for ip in addresses],
+        "classify_public": lambda: classify_public(addresses),
+    }
+    for name, run in timings.items():
+        best = min(timeit.repeat(run, number=1, repeat=5))
+        print(name.ljust(20) + str(round(best * 1e9 / n)).rjust(6) + " ns/address")
+
+    differences = [ip for ip, public in zip(addresses, classify_public(addresses))
+                   if public != legacy_isItPublic(ip)]
+    print(str(len(differences)) + " addresses classified differently, e.g. " + str(differences[:5]))
@@ -0,0 +1,127 @@
+"""
+Copyright (c) 2021 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+""" Circuit breaker for the reputation providers
+When a provider (Umbrella, WhoisXML...) is down or very slow, every lookup would wait for its timeout and the whole run
+would stall. Each provider has a circuit breaker that:
+- is closed while the provider answers, every request is sent
+- opens after a number of failures in a row (errors, 5xx, timeouts): no request is sent, the callers fall back on
+  cached verdicts and leave the other domains for the next run
+- after some time, becomes half-open and lets a single request through (probe). If it succeeds the breaker closes,
+  if not it opens again. A probe that ends without an answer (cancelled, out of quota) is released, and a probe that
+  takes longer than reset_seconds is given up, so the breaker never stays half-open without sending anything
+The thresholds are set in CIRCUIT_BREAKER in env.py.
+"""
+
+import threading
+import time
+
+import env
+
+settings = getattr(env, "CIRCUIT_BREAKER", {})
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class CircuitBreaker:
+    """ Tracks the failures of a provider and decides whether a request can be sent
+
+    Parameters
+    ----------
+    name: str
+        Name of the provider, used in the messages
+    failure_threshold: int
+        Number of failures in a row that open the breaker
+    reset_seconds: float
+        Seconds the breaker stays open before letting a probe through
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_seconds=60):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self.probing = False
+        self.probe_started = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """ Returns whether a request can be sent now
+        """
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            now = time.monotonic()
+            if self.state == OPEN and now - self.opened_at >= self.reset_seconds:
+                self.state = HALF_OPEN
+                self.probing = False
+            if self.state == HALF_OPEN and self.probing and now - self.probe_started >= self.reset_seconds:
+                # The probe never ended, let another one through
+                self.probing = False
+            if self.state == HALF_OPEN and not self.probing:
+                # Only one probe at a time
+                self.probing = True
+                self.probe_started = now
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self.lock:
+            if self.state != CLOSED:
+                print(self.name + " is answering again, circuit breaker closed")
+            self.state = CLOSED
+            self.failures = 0
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                if self.state == CLOSED:
+                    print(self.name + " failed " + str(self.failures) + " times in a row, circuit breaker opened for "
+                          + str(self.reset_seconds) + " seconds")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self.probing = False
+
+    def release(self):
+        """ The request let through by allow() ended without an answer (cancelled, out of quota), another probe can
+        be sent
+        """
+        with self.lock:
+            self.probing = False
+
+    def is_open(self):
+        with self.lock:
+            return self.state != CLOSED
+
+
+_breakers = {}
+_lock = threading.Lock()
+
+
+def get_breaker(name):
+    """ Returns the circuit breaker of a provider, shared by all the scripts, as configured in env.py
+    """
+    with _lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name, int(settings.get("failure_threshold", 5)),
+                                             settings.get("reset_seconds", 60))
+        return _breakers[name]
@@ -17,11 +17,16 @@ or implied.
 '''
 This script gets as the input the response from Umbrella, and formats it to be posted into CV Center
 
-Furthermore, this script is divided into 1 function:
+Furthermore, this script is divided into 2 functions:
 - Funcion 1 (CV_event()):
     DESCRIPTION: stores all the information that is necessary to post on CV into the "payload" dictionary
     INPUTS (1): the output from the Umbrella API
     OUTPUTS (1): the payload/message to be posted
+
+- Funcion 2 (CV_findings_event()):
+    DESCRIPTION: same as CV_event(), for several queries of the same domain, in a single message
+    INPUTS (1): list of outputs from the Umbrella API, one for each query (IP and Date)
+    OUTPUTS (1): the payload/message to be posted
 '''
 
 import requests
@@ -74,9 +79,26 @@ def CV_event(umbrella_output):
     else:
         message = "The domain " + str(domain) + " is malicious and it has been queried by the IP " + str(IP) + " on " + str(date) + ". Its associated risk score is " + str(risk) + "/100."
 
+    # Merged verdict of all the reputation providers (see reputation_engine.py)
+    if umbrella_output.get("merged_score") is not None:
+        message = message + " The combined score of " + str(len(umbrella_output["verdicts"])) + " reputation providers is " + str(umbrella_output["merged_score"]) + "/100."
+
     payload = {
     "task": "Malicious DNS Query",
     "alert": {"event-type": "extension_alert", "message": message}
     }
 
-    return payload
\ No newline at end of file
+    return payload
+
+
+## FUNCTION
+# Formats several queries of the same domain into a single event, the first one as in CV_event() followed by the IPs
+# and dates of the others
+def CV_findings_event(umbrella_outputs):
+    payload = CV_event(umbrella_outputs[0])
+
+    if len(umbrella_outputs) > 1:
+        others = ["the IP " + str(output["IP"]) + " on " + str(output["Date"]) for output in umbrella_outputs[1:]]
+        payload["alert"]["message"] = payload["alert"]["message"] + " It has also been queried by " + ", ".join(others) + "."
+
+    return payload
@@ -0,0 +1,107 @@
+"""
+Copyright (c) 2021 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+"""
+Keeps the DNS queries that could not be checked, for the next run.
+When Umbrella cannot be reached (see circuit_breaker.py) and a domain
+has no verdict in the cache, its queries ({"domain", "IP", "time",
+"deferred_at"}) are appended to a NDJSON file instead of being dropped.
+The next run takes them back and checks them along with the new ones.
+A query that is still deferred 'max_deferred_hours' after it was first
+deferred (CIRCUIT_BREAKER in env.py) is dropped.
+- defer_sightings: adds DNS queries to the file.
+- take_deferred: returns the DNS queries of the file, moving them to a
+  second file until the run ends.
+- commit_deferred: removes the DNS queries taken by the run, once they
+  have been processed or deferred again.
+"""
+
+import os
+import time
+
+import env
+from ndjson_io import RecordWriter, read_records
+
+settings = getattr(env, "CIRCUIT_BREAKER", {})
+deferred_file = settings.get("deferred_file", "deferred_domains.ndjson")
+# Queries taken by the current run, kept until it ends so that they are not lost if it stops on an error
+taken_file = deferred_file + ".taken"
+max_age = float(settings.get("max_deferred_hours", 72)) * 60 * 60
+
+
+def defer_sightings(queries):
+    """
+    Appends a list of DNS queries to the file, with the time they were
+    first deferred. The queries deferred for longer than
+    'max_deferred_hours' are dropped. Returns the number of queries
+    added.
+    """
+    if not queries:
+        return 0
+    now = int(time.time())
+    dropped = 0
+    with RecordWriter(deferred_file, append=True) as writer:
+        for query in queries:
+            deferred_at = int(query.get("deferred_at", now))
+            if now - deferred_at > max_age:
+                dropped += 1
+                continue
+            writer.write({"domain": query["domain"], "IP": query["IP"], "time": query["time"],
+                          "deferred_at": deferred_at})
+    if writer.count:
+        print(str(writer.count) + " DNS queries could not be checked, they will be checked on the next run")
+    if dropped:
+        print(str(dropped) + " DNS queries dropped, they could not be checked for more than "
+              + "{:g}".format(max_age / 3600) + " hours")
+    return writer.count
+
+
+def take_deferred():
+    """
+    Returns the list of DNS queries kept by the previous runs. They are
+    moved to the taken file, which is removed by commit_deferred().
+    """
+    if os.path.exists(deferred_file):
+        if os.path.exists(taken_file):
+            # A previous run stopped before the end, its queries are taken again along with the new ones
+            with RecordWriter(taken_file, append=True) as writer:
+                for query in read_records(deferred_file):
+                    writer.write(query)
+            os.remove(deferred_file)
+        else:
+            os.replace(deferred_file, taken_file)
+    if not os.path.exists(taken_file):
+        return []
+
+    # The same query may have been deferred twice if a run stopped, the first time it was deferred is kept
+    queries = {}
+    for query in read_records(taken_file):
+        key = (query["domain"], query["IP"], query["time"])
+        if key not in queries or query.get("deferred_at", 0) < queries[key].get("deferred_at", 0):
+            queries[key] = query
+    if queries:
+        print(str(len(queries)) + " DNS queries left by the previous run are checked again")
+    return list(queries.values())
+
+
+def commit_deferred():
+    """
+    Removes the DNS queries taken by take_deferred(), once the run has
+    processed them or deferred them again.
+    """
+    if os.path.exists(taken_file):
+        os.remove(taken_file)
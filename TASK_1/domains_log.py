@@ -0,0 +1,286 @@
+"""
+Copyright (c) 2021 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+""" Log-structured backend of the domains DB
+Alternative to the SQLite file of domains_store.py, selected with 'backend': 'log' in DOMAINS_STORE (env.py). The DB is
+a directory with:
+- segment-<N>.ndjson: every change (query added, domain pushed...) appended as one json line. A run only appends the
+  lines of its changes, in a single write when it commits, whatever the size of the DB
+- snapshot.json: the whole DB as of the start of segment N
+When the DB is opened, the snapshot is loaded and the segments are replayed on top of it, into an index in memory.
+Compacting folds the segments into a new snapshot and starts a new segment. It is done when a segment reaches
+'compact_records' lines, or by running "python3 domains_store.py compact".
+A crash while writing can only leave a partial last line in the segment, which is dropped when the DB is opened again.
+A crash while compacting leaves either the previous snapshot and its segments, or the new ones.
+"""
+
+import glob
+import json
+import os
+import threading
+from collections import deque
+
+from domains_store import sketch_add, sketch_count, to_epoch, SKETCH_SIZE
+
+
+class DomainsLog:
+    """ Domains DB in a snapshot and append-only segments, with the same methods as DomainsStore
+
+    Parameters
+    ----------
+    path: str
+        The directory of the DB, created if it does not exist
+    keep_queries: int
+        Number of queries kept for each domain, the older ones are only kept in the rollups
+    compact_records: int
+        Number of lines of a segment after which it is folded into the snapshot when committing
+    """
+
+    def __init__(self, path, keep_queries=100, compact_records=100000):
+        self.lock = threading.Lock()
+        self.path = path
+        self.keep_queries = keep_queries
+        self.compact_records = compact_records
+        # domain: {"count", "first_seen", "last_seen", "ip_sketch", "days", "queries"}
+        self.domains = {}
+        # domain: epoch of the last push into CV
+        self.pushed = {}
+        self.meta = {}
+        # Changes not written yet, and lines of the segments not folded into the snapshot yet
+        self.pending = []
+        self.records = 0
+        # Queries dropped from the domains since the last compaction, only kept in their rollups
+        self.dropped = 0
+        self.generation = 0
+        os.makedirs(path, exist_ok=True)
+        self.load()
+        self.segment = open(self.segment_path(self.generation), "ab")
+
+    def segment_path(self, generation):
+        return os.path.join(self.path, "segment-" + str(generation) + ".ndjson")
+
+    def load(self):
+        """ Loads the snapshot and replays the segments written after it
+        """
+        snapshot = os.path.join(self.path, "snapshot.json")
+        if os.path.exists(snapshot):
+            with open(snapshot, "r") as f:
+                data = json.load(f)
+            self.generation = data["generation"]
+            self.meta = data["meta"]
+            self.pushed = data["pushed"]
+            for domain, entry in data["domains"].items():
+                entry["ip_sketch"] = bytearray.fromhex(entry["ip_sketch"])
+                entry["queries"] = deque((tuple(query) for query in entry["queries"]), maxlen=self.keep_queries)
+                self.domains[domain] = entry
+
+        segments = sorted((int(os.path.basename(p)[len("segment-"):-len(".ndjson")]), p)
+                          for p in glob.glob(os.path.join(self.path, "segment-*.ndjson")))
+        for generation, path in segments:
+            if generation < self.generation:
+                # Already folded into the snapshot, left by a compaction that did not finish
+                os.remove(path)
+            else:
+                self.replay(path)
+                self.generation = generation
+        self.dropped = 0
+
+    def replay(self, path):
+        """ Applies the lines of a segment. A partial last line, left by a crash, is removed from the file
+        """
+        good = 0
+        with open(path, "rb") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    if line.endswith(b"\n"):
+                        print("Skipping an invalid line in " + path)
+                        good += len(line)
+                        continue
+                    break
+                self.apply(record)
+                self.records += 1
+                good += len(line)
+        if good < os.path.getsize(path):
+            print("Removing the incomplete last change of " + path)
+            with open(path, "r+b") as f:
+                f.truncate(good)
+
+    def apply(self, record):
+        """ Applies a change to the index in memory
+        """
+        kind = record["op"]
+        if kind in ("q", "c") and record["d"] not in self.domains:
+            self.domains[record["d"]] = {"count": 0, "first_seen": None, "last_seen": None,
+                                         "ip_sketch": bytearray(SKETCH_SIZE), "days": {},
+                                         "queries": deque(maxlen=self.keep_queries)}
+        if kind == "q":
+            entry = self.domains[record["d"]]
+            epoch = to_epoch(record["t"])
+            entry["count"] += 1
+            entry["first_seen"] = epoch if entry["first_seen"] is None else min(entry["first_seen"], epoch)
+            entry["last_seen"] = epoch if entry["last_seen"] is None else max(entry["last_seen"], epoch)
+            sketch_add(entry["ip_sketch"], record["ip"])
+            day = record["t"][:10]
+            entry["days"][day] = entry["days"].get(day, 0) + 1
+            if len(entry["queries"]) == self.keep_queries:
+                self.dropped += 1
+            entry["queries"].append((record["ip"], record["t"]))
+        elif kind == "c":
+            self.domains[record["d"]]["count"] = record["n"]
+        elif kind == "p":
+            self.pushed[record["d"]] = max(self.pushed.get(record["d"], record["e"]), record["e"])
+        elif kind == "m":
+            self.meta[record["k"]] = record["v"]
+
+    def change(self, record):
+        """ Applies a change and keeps it to be written by commit(). Called with the lock held
+        """
+        self.apply(record)
+        self.pending.append(record)
+
+    def build_pushed_index(self):
+        """ Fills the pushed index with the last time each domain was queried, only the first time
+        """
+        with self.lock:
+            if "pushed_index" in self.meta:
+                return
+            for domain, entry in self.domains.items():
+                if domain not in self.pushed and entry["last_seen"] is not None:
+                    self.change({"op": "p", "d": domain, "e": entry["last_seen"]})
+            self.change({"op": "m", "k": "pushed_index", "v": "1"})
+        self.commit()
+
+    def exists(self, domain):
+        """ Returns whether the domain has already been queried
+        """
+        with self.lock:
+            return domain in self.domains
+
+    def last_query(self, domain):
+        """ Returns the last query of the domain, as a {"IP", "time"} dictionary, or None if it has never been queried
+        """
+        with self.lock:
+            entry = self.domains.get(domain)
+            if entry is None or not entry["queries"]:
+                return None
+            ip, time = entry["queries"][-1]
+        return {"IP": ip, "time": time}
+
+    def get(self, domain):
+        """ Returns the domain in the same format as DomainsStore.get(), None if it has never been queried
+        """
+        with self.lock:
+            entry = self.domains.get(domain)
+            if entry is None:
+                return None
+            return {"domain": domain, "count": entry["count"],
+                    "queries": [{"IP": ip, "time": time} for ip, time in entry["queries"]],
+                    "first_seen": entry["first_seen"], "last_seen": entry["last_seen"],
+                    "distinct_ips": sketch_count(entry["ip_sketch"]), "days": dict(sorted(entry["days"].items()))}
+
+    def last_pushed(self, domains):
+        """ Returns the last time (epoch seconds) each of the domains was pushed into CV, as a {domain: epoch}
+        dictionary. The domains that have never been pushed are left out
+        """
+        with self.lock:
+            return {domain: self.pushed[domain] for domain in domains if domain in self.pushed}
+
+    def mark_pushed(self, domain, epoch):
+        """ Records that a query of the domain, at epoch seconds, has been pushed into CV. The change is saved by
+        commit()
+        """
+        with self.lock:
+            self.change({"op": "p", "d": domain, "e": epoch})
+
+    def add_query(self, domain, ip, time):
+        """ Adds a query of the domain, adding the domain if it is the first one, and updates its rollups. The change
+        is saved by commit()
+        """
+        with self.lock:
+            self.change({"op": "q", "d": domain, "ip": ip, "t": time})
+
+    def write(self):
+        """ Appends the pending changes to the segment, in a single write. Called with the lock held
+        """
+        if self.pending:
+            self.segment.write(b"".join(json.dumps(record, separators=(",", ":")).encode("utf-8") + b"\n"
+                                        for record in self.pending))
+            self.segment.flush()
+            os.fsync(self.segment.fileno())
+            self.records += len(self.pending)
+            self.pending = []
+
+    def commit(self):
+        """ Saves the changes, and compacts the DB if the segment is too long
+        """
+        with self.lock:
+            self.write()
+            full = self.records >= self.compact_records
+        if full:
+            self.compact()
+
+    def compact(self):
+        """ Folds the segments into a new snapshot and starts a new segment. Returns the number of queries removed,
+        that were older than the last keep_queries ones of their domain
+        """
+        with self.lock:
+            self.write()
+            generation = self.generation + 1
+            data = {"generation": generation, "meta": self.meta, "pushed": self.pushed,
+                    "domains": {domain: {"count": entry["count"], "first_seen": entry["first_seen"],
+                                         "last_seen": entry["last_seen"], "ip_sketch": entry["ip_sketch"].hex(),
+                                         "days": entry["days"], "queries": list(entry["queries"])}
+                                for domain, entry in self.domains.items()}}
+            snapshot = os.path.join(self.path, "snapshot.json")
+            with open(snapshot + ".tmp", "w") as f:
+                json.dump(data, f, separators=(",", ":"))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(snapshot + ".tmp", snapshot)
+
+            # From here the old segments are not needed, the snapshot starts at the new one
+            self.segment.close()
+            for old in range(self.generation, generation):
+                if os.path.exists(self.segment_path(old)):
+                    os.remove(self.segment_path(old))
+            self.generation = generation
+            self.segment = open(self.segment_path(generation), "ab")
+            self.records = 0
+            removed = self.dropped
+            self.dropped = 0
+        return removed
+
+    def migrate_json(self, path):
+        """ Copies the domains of a json domains DB, only the first time. Returns the number of domains copied
+        """
+        with self.lock:
+            if "migrated_json" in self.meta:
+                return 0
+            count = 0
+            if os.path.exists(path):
+                with open(path, "r") as f:
+                    domains = json.load(f).get("list", [])
+                for item in domains:
+                    for query in item.get("queries", []):
+                        self.change({"op": "q", "d": item["domain"], "ip": query["IP"], "t": query["time"]})
+                    # Keep the count of the json file, in case it does not match the number of queries
+                    self.change({"op": "c", "d": item["domain"], "n": item.get("count", len(item.get("queries", [])))})
+                    count += 1
+            self.change({"op": "m", "k": "migrated_json", "v": path})
+        self.commit()
+        if count:
+            print(str(count) + " domains copied from " + path + " into the domains DB")
+        return count
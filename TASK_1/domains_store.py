@@ -0,0 +1,309 @@
+"""
+Copyright (c) 2021 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+""" Database of the malicious domains that have been queried (domains DB)
+The domains DB used to be a json file (domains_DB.json) that was searched from the start for every DNS query and
+rewritten completely after each one. It is now a SQLite file with an index on the domain:
+- finding a domain, or the last time it was queried, is an index lookup
+- the new DNS queries of a run are written in a single transaction, committed at the end of the run
+The first time the store is opened, the content of domains_DB.json is copied into it. The json file is left in place,
+but it is no longer updated.
+Only the last queries of each domain are kept ('keep_queries' in DOMAINS_STORE, in env.py). The older ones are summed up
+in rollups that do not grow with the number of queries:
+- the first and last time the domain was queried (epoch seconds)
+- the number of queries per day
+- the number of different IPs that queried it, estimated with a 256-byte HyperLogLog sketch
+A DB created by a previous version is shrunk with compact(), or by running "python3 domains_store.py compact".
+The DB can also be kept in an append-only log instead of SQLite (see domains_log.py), with 'backend' in DOMAINS_STORE.
+The time each domain was last pushed into CV is kept in an index of epoch seconds (pushed table), so whether to push
+the queries of a run is decided for all of them at once, from integers (see last_pushed() and process_events.py). A DB
+created by a previous version starts with the last time each domain was queried.
+"""
+
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import sys
+import threading
+from datetime import datetime
+
+import env
+
+settings = getattr(env, "DOMAINS_STORE", {})
+
+# Number of registers of the distinct IPs sketch, standard error about 1.04 / sqrt(SKETCH_SIZE) = 6.5%
+SKETCH_SIZE = 256
+
+
+def sketch_add(sketch, ip):
+    """ Adds an IP to a HyperLogLog sketch (bytearray of SKETCH_SIZE registers)
+    """
+    value = int.from_bytes(hashlib.blake2b(ip.encode("utf-8"), digest_size=8).digest(), "little")
+    register = value & (SKETCH_SIZE - 1)
+    rest = value >> 8
+    # Position of the first 1 bit in the remaining 56 bits
+    rank = 56 - rest.bit_length() + 1
+    if rank > sketch[register]:
+        sketch[register] = rank
+
+
+def sketch_count(sketch):
+    """ Estimated number of different IPs added to a sketch
+    """
+    alpha = 0.7213 / (1 + 1.079 / SKETCH_SIZE)
+    estimate = alpha * SKETCH_SIZE * SKETCH_SIZE / sum(2.0 ** -r for r in sketch)
+    zeros = sketch.count(0)
+    if estimate <= 2.5 * SKETCH_SIZE and zeros:
+        # Few IPs, linear counting is more accurate
+        estimate = SKETCH_SIZE * math.log(SKETCH_SIZE / zeros)
+    return int(round(estimate))
+
+
+def to_epoch(time):
+    """ Converts the time of a query ("%Y-%m-%d %H:%M:%S") to epoch seconds
+    """
+    # Same result as strptime with the format above, without parsing the format on every call
+    return int(datetime.fromisoformat(time).timestamp())
+
+
+class DomainsStore:
+    """ Domains DB in a SQLite file
+
+    Parameters
+    ----------
+    path: str
+        The SQLite file, created if it does not exist
+    keep_queries: int
+        Number of queries kept for each domain, the older ones are only kept in the rollups
+    mmap_size: int
+        Bytes of the file that SQLite memory-maps, 0 to disable
+    """
+
+    def __init__(self, path, keep_queries=100, mmap_size=256 * 1024 * 1024):
+        self.lock = threading.Lock()
+        self.keep_queries = keep_queries
+        # Domains with new queries since the last commit, their old queries are removed when committing
+        self.touched = set()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        # Reads go through a memory map of the file instead of copies in the page cache of the connection
+        self.db.execute("PRAGMA mmap_size=" + str(int(mmap_size)))
+        self.db.execute("CREATE TABLE IF NOT EXISTS domains (domain TEXT PRIMARY KEY, count INTEGER)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS queries (id INTEGER PRIMARY KEY, domain TEXT, ip TEXT, time TEXT)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS queries_domain ON queries (domain, id)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS daily (domain TEXT, day TEXT, count INTEGER, "
+                        "PRIMARY KEY (domain, day))")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS pushed (domain TEXT PRIMARY KEY, epoch INTEGER)")
+
+        # Rollup columns, missing in the DBs created by previous versions
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(domains)")]
+        for column, kind in (("first_seen", "INTEGER"), ("last_seen", "INTEGER"), ("ip_sketch", "BLOB")):
+            if column not in columns:
+                self.db.execute("ALTER TABLE domains ADD COLUMN " + column + " " + kind)
+        self.db.commit()
+        self.build_rollups()
+
+    def build_rollups(self):
+        """ Computes the rollups from the queries of a DB created by a previous version, only the first time
+        """
+        with self.lock:
+            if self.db.execute("SELECT 1 FROM meta WHERE key = 'rollups'").fetchone() is not None:
+                return
+            rollups = {}
+            for domain, ip, time in self.db.execute("SELECT domain, ip, time FROM queries ORDER BY id"):
+                rollup = rollups.setdefault(domain, [None, None, bytearray(SKETCH_SIZE), {}])
+                epoch = to_epoch(time)
+                rollup[0] = epoch if rollup[0] is None else min(rollup[0], epoch)
+                rollup[1] = epoch if rollup[1] is None else max(rollup[1], epoch)
+                sketch_add(rollup[2], ip)
+                rollup[3][time[:10]] = rollup[3].get(time[:10], 0) + 1
+            for domain, (first, last, sketch, days) in rollups.items():
+                self.db.execute("UPDATE domains SET first_seen = ?, last_seen = ?, ip_sketch = ? WHERE domain = ?",
+                                (first, last, bytes(sketch), domain))
+                self.db.executemany("INSERT OR REPLACE INTO daily (domain, day, count) VALUES (?, ?, ?)",
+                                    [(domain, day, count) for day, count in days.items()])
+            self.db.execute("INSERT INTO meta (key, value) VALUES ('rollups', '1')")
+            self.db.commit()
+
+    def build_pushed_index(self):
+        """ Fills the pushed index of a DB created by a previous version with the last time each domain was queried,
+        only the first time
+        """
+        with self.lock:
+            if self.db.execute("SELECT 1 FROM meta WHERE key = 'pushed_index'").fetchone() is not None:
+                return
+            self.db.execute("INSERT OR IGNORE INTO pushed (domain, epoch) SELECT domain, last_seen FROM domains "
+                            "WHERE last_seen IS NOT NULL")
+            self.db.execute("INSERT INTO meta (key, value) VALUES ('pushed_index', '1')")
+            self.db.commit()
+
+    def exists(self, domain):
+        """ Returns whether the domain has already been queried
+        """
+        with self.lock:
+            return self.db.execute("SELECT 1 FROM domains WHERE domain = ?", (domain,)).fetchone() is not None
+
+    def last_query(self, domain):
+        """ Returns the last query of the domain, as a {"IP", "time"} dictionary, or None if it has never been queried
+        """
+        with self.lock:
+            row = self.db.execute("SELECT ip, time FROM queries WHERE domain = ? ORDER BY id DESC LIMIT 1",
+                                  (domain,)).fetchone()
+        return None if row is None else {"IP": row[0], "time": row[1]}
+
+    def get(self, domain):
+        """ Returns the domain as in the json file: {"domain", "count", "queries": [{"IP", "time"}]} (only the last
+        queries), plus its rollups: "first_seen", "last_seen", "distinct_ips" and "days" ({day: count}). None if the
+        domain has never been queried
+        """
+        with self.lock:
+            row = self.db.execute("SELECT count, first_seen, last_seen, ip_sketch FROM domains WHERE domain = ?",
+                                  (domain,)).fetchone()
+            if row is None:
+                return None
+            queries = self.db.execute("SELECT ip, time FROM queries WHERE domain = ? ORDER BY id",
+                                      (domain,)).fetchall()
+            days = self.db.execute("SELECT day, count FROM daily WHERE domain = ? ORDER BY day", (domain,)).fetchall()
+        return {"domain": domain, "count": row[0], "queries": [{"IP": ip, "time": time} for ip, time in queries],
+                "first_seen": row[1], "last_seen": row[2],
+                "distinct_ips": sketch_count(bytearray(row[3])) if row[3] else 0, "days": dict(days)}
+
+    def last_pushed(self, domains):
+        """ Returns the last time (epoch seconds) each of the domains was pushed into CV, as a {domain: epoch}
+        dictionary. The domains that have never been pushed are left out
+        """
+        domains = list(domains)
+        pushed = {}
+        with self.lock:
+            # Under the limit of parameters of a SQLite query
+            for i in range(0, len(domains), 500):
+                chunk = domains[i:i + 500]
+                pushed.update(self.db.execute("SELECT domain, epoch FROM pushed WHERE domain IN ("
+                                              + ", ".join("?" * len(chunk)) + ")", chunk).fetchall())
+        return pushed
+
+    def mark_pushed(self, domain, epoch):
+        """ Records that a query of the domain, at epoch seconds, has been pushed into CV. The change is saved by
+        commit()
+        """
+        with self.lock:
+            self.db.execute("INSERT INTO pushed (domain, epoch) VALUES (?, ?) "
+                            "ON CONFLICT(domain) DO UPDATE SET epoch = max(epoch, excluded.epoch)", (domain, epoch))
+
+    def add_query(self, domain, ip, time):
+        """ Adds a query of the domain, adding the domain if it is the first one, and updates its rollups. The change
+        is saved by commit()
+        """
+        epoch = to_epoch(time)
+        with self.lock:
+            row = self.db.execute("SELECT ip_sketch FROM domains WHERE domain = ?", (domain,)).fetchone()
+            sketch = bytearray(row[0]) if row is not None and row[0] else bytearray(SKETCH_SIZE)
+            sketch_add(sketch, ip)
+            self.db.execute("INSERT INTO domains (domain, count, first_seen, last_seen, ip_sketch) VALUES (?, 1, ?, ?, ?) "
+                            "ON CONFLICT(domain) DO UPDATE SET count = count + 1, "
+                            "first_seen = min(coalesce(first_seen, excluded.first_seen), excluded.first_seen), "
+                            "last_seen = max(coalesce(last_seen, excluded.last_seen), excluded.last_seen), "
+                            "ip_sketch = excluded.ip_sketch", (domain, epoch, epoch, bytes(sketch)))
+            self.db.execute("INSERT INTO queries (domain, ip, time) VALUES (?, ?, ?)", (domain, ip, time))
+            self.db.execute("INSERT INTO daily (domain, day, count) VALUES (?, ?, 1) "
+                            "ON CONFLICT(domain, day) DO UPDATE SET count = count + 1", (domain, time[:10]))
+            self.touched.add(domain)
+
+    def trim(self, domain):
+        """ Removes the queries of a domain older than the last keep_queries ones
+        """
+        self.db.execute("DELETE FROM queries WHERE domain = ? AND id <= (SELECT id FROM queries WHERE domain = ? "
+                        "ORDER BY id DESC LIMIT 1 OFFSET ?)", (domain, domain, self.keep_queries))
+
+    def commit(self):
+        with self.lock:
+            for domain in self.touched:
+                self.trim(domain)
+            self.touched.clear()
+            self.db.commit()
+
+    def compact(self):
+        """ Removes the old queries of all the domains and shrinks the file. Returns the number of queries removed
+        """
+        with self.lock:
+            before = self.db.execute("SELECT count(*) FROM queries").fetchone()[0]
+            for (domain,) in self.db.execute("SELECT domain FROM domains").fetchall():
+                self.trim(domain)
+            self.touched.clear()
+            self.db.commit()
+            removed = before - self.db.execute("SELECT count(*) FROM queries").fetchone()[0]
+            self.db.execute("VACUUM")
+        return removed
+
+    def migrate_json(self, path):
+        """ Copies the domains of a json domains DB, only the first time. Returns the number of domains copied
+        """
+        with self.lock:
+            if self.db.execute("SELECT 1 FROM meta WHERE key = 'migrated_json'").fetchone() is not None:
+                return 0
+        count = 0
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                domains = json.load(f).get("list", [])
+            for item in domains:
+                for query in item.get("queries", []):
+                    self.add_query(item["domain"], query["IP"], query["time"])
+                # Keep the count of the json file, in case it does not match the number of queries
+                with self.lock:
+                    self.db.execute("INSERT INTO domains (domain, count) VALUES (?, ?) "
+                                    "ON CONFLICT(domain) DO UPDATE SET count = excluded.count",
+                                    (item["domain"], item.get("count", len(item.get("queries", [])))))
+                count += 1
+        with self.lock:
+            self.db.execute("INSERT INTO meta (key, value) VALUES ('migrated_json', ?)", (path,))
+            self.db.commit()
+        if count:
+            print(str(count) + " domains copied from " + path + " into the domains DB")
+        return count
+
+
+_domains_store = None
+_lock = threading.Lock()
+
+
+def get_domains_store():
+    """ Returns the domains DB shared by all the scripts, opened on first use and copying domains_DB.json into it the
+    first time. No script opens the DB when it is imported
+    """
+    global _domains_store
+    with _lock:
+        if _domains_store is None:
+            if settings.get("backend", "sqlite") == "log":
+                # Imported here, domains_log uses the functions of this script
+                from domains_log import DomainsLog
+                _domains_store = DomainsLog(settings.get("log_dir", "domains_DB.log"),
+                                            int(settings.get("keep_queries", 100)),
+                                            int(settings.get("compact_records", 100000)))
+            else:
+                _domains_store = DomainsStore(settings.get("file", "domains_DB.sqlite"),
+                                              int(settings.get("keep_queries", 100)),
+                                              int(settings.get("mmap_mb", 256)) * 1024 * 1024)
+            _domains_store.migrate_json(settings.get("json_file", "domains_DB.json"))
+            _domains_store.build_pushed_index()
+        return _domains_store
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["compact"]:
+        print(str(get_domains_store().compact()) + " old queries removed from the domains DB")
+    else:
+        print("Usage: python3 domains_store.py compact")
@@ -0,0 +1,71 @@
+"""
+Copyright (c) 2021 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+"""
+Keeps the first appearance of each public IP address.
+The index is a dictionary keyed by IP address, holding the first
+activity as an integer timestamp in milliseconds. Adding a sighting or
+merging two indexes keeps the earliest timestamp, so indexes built by
+parallel workers or by different runs can be combined in any order.
+- record_first_seen: adds one sighting of an IP address to an index.
+- merge_first_seen: merges an index into another one.
+- load_first_seen / save_first_seen: read and write an index as a json
+    file.
+"""
+
+import json
+import os
+
+
+def record_first_seen(index, ip, activity):
+    """
+    Adds a sighting to the index, keeping the earliest activity.
+    Parameters: index dictionary, string IP address, first activity in
+    milliseconds.
+    """
+    activity = int(activity)
+    current = index.get(ip)
+    if current is None or activity < current:
+        index[ip] = activity
+
+
+def merge_first_seen(index, other):
+    """
+    Merges the other index into index, keeping the earliest activity of
+    each IP address. Returns index.
+    """
+    for ip, activity in other.items():
+        record_first_seen(index, ip, activity)
+    return index
+
+
+def load_first_seen(path):
+    """
+    Reads an index from a json file, an empty index if it does not exist.
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return {ip: int(activity) for ip, activity in json.load(f).items()}
+
+
+def save_first_seen(path, index):
+    """
+    Writes an index to a json file.
+    """
+    with open(path, "w") as f:
+        json.dump(index, f)
@@ -0,0 +1,136 @@
+"""
+Copyright (c) 2021 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+""" Keeps the details of the Cyber Vision flows on disk between runs
+The first activity, the IPs and the DNS properties of a flow never change once it has been recorded, so
+there is no need to request /flows/{id} again for a flow that has already been seen.
+This script stores those fields in a SQLite file, keyed by flow id. When the file holds more flows than
+the limit set in env.py (FLOW_CACHE), the flows that have not been used for the longest time are removed.
+- FlowCache: the cache itself, with get_or_fetch() and the hit/miss counters
+- get_flow_cache: returns the cache shared by all the scripts, opened on first use
+"""
+
+import json
+import sqlite3
+import threading
+import env
+
+# Fields of a flow that never change and are used by the Task 1 scripts
+FLOW_FIELDS = ['id', 'firstActivity', 'left', 'right', 'properties', 'tags']
+
+
+def trim_flow(details):
+    """ Keeps only the fields of a flow that never change
+    """
+    flow = {key: details[key] for key in FLOW_FIELDS if key in details}
+    for side in ['left', 'right']:
+        if isinstance(flow.get(side), dict):
+            flow[side] = {'ip': flow[side].get('ip')}
+    return flow
+
+
+class FlowCache:
+    """ Size-bounded cache of flow details stored in SQLite, with LRU eviction
+
+    Parameters
+    ----------
+    path: str
+        The SQLite file, created if it does not exist
+    max_entries: int
+        Maximum number of flows kept in the file
+    """
+
+    def __init__(self, path, max_entries=500000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        # The cache is used from the worker threads of flow_fetcher.py, the lock serializes the access
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS flows (id TEXT PRIMARY KEY, data TEXT, last_used INTEGER)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS flows_last_used ON flows (last_used)")
+        self.count, self.clock = self.db.execute("SELECT COUNT(*), COALESCE(MAX(last_used), 0) FROM flows").fetchone()
+
+    def get(self, flow_id):
+        with self.lock:
+            row = self.db.execute("SELECT data FROM flows WHERE id = ?", (flow_id,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.clock += 1
+            self.db.execute("UPDATE flows SET last_used = ? WHERE id = ?", (self.clock, flow_id))
+            return json.loads(row[0])
+
+    def put(self, flow_id, details):
+        with self.lock:
+            self.clock += 1
+            # Only called for flows missing from the cache, so the count grows by one
+            self.db.execute("INSERT OR REPLACE INTO flows (id, data, last_used) VALUES (?, ?, ?)",
+                            (flow_id, json.dumps(trim_flow(details)), self.clock))
+            self.count += 1
+            if self.count > self.max_entries:
+                self.evict()
+
+    def evict(self):
+        """ Removes the least recently used flows, leaving 10% of free space so this does not run on every insert
+        """
+        keep = int(self.max_entries * 0.9)
+        self.db.execute("DELETE FROM flows WHERE id IN (SELECT id FROM flows ORDER BY last_used LIMIT ?)",
+                        (self.count - keep,))
+        self.count = keep
+
+    def get_or_fetch(self, flow_id, fetch):
+        """ Returns the details of a flow from the cache, or from fetch(flow_id) if it has never been seen
+
+        Parameters
+        ----------
+        flow_id: str
+            The id of the flow
+        fetch: function
+            Makes the API call for the flow, returns its details or None if the call failed (not cached)
+        """
+        details = self.get(flow_id)
+        if details is None:
+            details = fetch(flow_id)
+            if details is not None:
+                self.put(flow_id, details)
+        return details
+
+    def commit(self):
+        with self.lock:
+            self.db.commit()
+
+    def print_stats(self):
+        total = self.hits + self.misses
+        rate = (100.0 * self.hits / total) if total else 0
+        print("Flow cache: " + str(self.hits) + " hits, " + str(self.misses) + " misses (" + str(round(rate, 1)) + "% hit rate)")
+
+
+_flow_cache = None
+_lock = threading.Lock()
+
+
+def get_flow_cache():
+    """ Returns the flow cache shared by all the scripts, as configured in env.py
+    """
+    global _flow_cache
+    with _lock:
+        if _flow_cache is None:
+            settings = getattr(env, "FLOW_CACHE", {})
+            _flow_cache = FlowCache(settings.get("file", "flow_cache.sqlite"),
+                                    int(settings.get("max_entries", 500000)))
+        return _flow_cache
@@ -0,0 +1,78 @@
+"""
+Copyright (c) 2021 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+""" Runs many Cyber Vision API requests in parallel
+This script uses the function fetch_concurrently() to fan out a list of API calls (one per component or
+per flow) over a bounded pool of worker threads. Results are yielded as soon as each request completes, so
+the caller can process them without waiting for the whole list.
+The number of workers is defined within env.py (CONCURRENCY = {'workers': X}).
+"""
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import env
+
+
+# Number of parallel requests used when the env file does not define one
+DEFAULT_WORKERS = 8
+
+
+def get_workers():
+    """ Returns the number of worker threads configured in env.py
+    """
+    workers = getattr(env, "CONCURRENCY", {}).get("workers")
+    if not workers or not str(workers).isdigit() or int(workers) < 1:
+        return DEFAULT_WORKERS
+    return int(workers)
+
+
+def fetch_concurrently(items, fetch, workers=None):
+    """ Calls fetch(item) for every item using a bounded pool of threads
+
+    Parameters
+    ----------
+    items: iterable
+        The values passed to fetch, e.g. component ids or flow ids
+    fetch: function
+        Function making the API call for a single item and returning its result
+    workers: int
+        Number of requests running at the same time, taken from env.py if not given
+
+    Yields
+    ------
+    tuple
+        (item, result) pairs, in the order in which the requests complete
+    """
+    workers = workers or get_workers()
+    items = iter(items)
+    # Never queue more than a few requests per worker, so that a very long list of
+    # flows does not create tens of thousands of pending futures at once
+    max_pending = workers * 4
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {}
+        for item in items:
+            pending[executor.submit(fetch, item)] = item
+            if len(pending) >= max_pending:
+                break
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = pending.pop(future)
+                yield item, future.result()
+
+                # Refill the queue with the next item, if there is any left
+                for next_item in items:
+                    pending[executor.submit(fetch, next_item)] = next_item
+                    break
@@ -0,0 +1,347 @@
+"""
+Copyright (c) 2021 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+""" Walks the Cyber Vision flows once for both TASK_1_1 and TASK_1_2
+TASK_1_1 needs the domains queried in the DNS flows, TASK_1_2 needs the public IPs seen in all the flows.
+Instead of each task listing the flows and requesting every flow detail on its own, this script does it
+once and writes the results for both tasks:
+- scan_flows: lists the flows newer than the cursor of the previous scan (and within the period given, if any),
+    requests the details of the new flows (only the DNS ones if the IP output is disabled) in parallel (through the flow cache) and appends
+    - a {'domain', 'IP', 'time'} record for every DNS flow to the pending DNS file
+    - the first activity of every public IP to the pending IP file, a json map {ip: first activity} where
+      each IP appears once (see first_seen.py)
+- collect_public_ips: the first activity of every public IP in all the flows of the period, used by TASK_1_2 instead
+    of the pending IP file when SCAN['ips_mode'] is 'period'. The flow details come from the flow cache, so only the
+    flows never seen before are requested
+- defer_public_ips: puts public IPs back in the pending IP file, for the IPs that TASK_1_2 could not check.
+- take_pending: used by the tasks to take the file of records waiting for them. The flows are scanned again first,
+    unless the last scan is more recent than SCAN['max_age_minutes'] in the env file.
+- commit_pending: removes the records taken by a task, once it has processed them.
+Each task takes its own pending file away, so no record is processed twice, whatever the order in which the tasks are
+run. The records taken are kept in a second file until the task commits them, so a run that stops before the end does
+not lose them: the next run takes them again, along with the new ones. Outputs that no task reads can be disabled in SCAN['outputs'].
+"""
+
+import json
+import os
+import shutil
+from datetime import datetime
+
+import env
+from api_client import get_cybervision_client
+from flow_fetcher import fetch_concurrently
+from flow_cache import get_flow_cache
+from ndjson_io import RecordWriter, read_records
+from ip_classifier import classify_public
+from first_seen import record_first_seen, merge_first_seen, load_first_seen, save_first_seen
+
+base_url = env.CYBERVISION["base_url"].rstrip("/")
+headers = {
+    "x-token-id": env.CYBERVISION["x-token-id"]
+}
+
+cursor_file = env.CURSOR.get('file', 'retrieve_urls_cursor.json')
+# Flows are sometimes reported late by the sensors, the window is opened a bit before the cursor to catch them
+cursor_overlap = int(env.CURSOR.get('overlap_minutes', 0)) * 60000
+
+scan_settings = getattr(env, "SCAN", {})
+scan_outputs = scan_settings.get('outputs', ['dns', 'ips'])
+# In 'period' mode TASK_1_2 gets the IPs of all the flows of the period on every run (see collect_public_ips), they are
+# not collected by the shared scan
+if scan_settings.get('ips_mode', 'new') == 'period':
+    scan_outputs = [output for output in scan_outputs if output != 'ips']
+max_age = int(scan_settings.get('max_age_minutes', 0)) * 60000
+
+# Files where the records are kept until the task that needs them reads them
+PENDING_FILES = {
+    'dns': "pending_domains.ndjson",
+    'ips': "pending_public_ips.json"
+}
+# Outputs taken by this run, that commit_pending() may remove
+taken_outputs = set()
+
+
+# This function converts a timestamp to a readable date/time value
+def convert_to_time(timestamp):
+    timestamp = int(str(timestamp)[0:10])
+    return str(datetime.fromtimestamp(timestamp))
+
+# Returns the current time in milliseconds, as used by the Cyber Vision API
+def current_ms():
+    return int(datetime.now().timestamp()) * 1000
+
+# Reads the cursor saved by the previous scan, or an empty one if this is the first scan
+def load_cursor():
+    if not os.path.exists(cursor_file):
+        return {'last_activity': 0, 'flow_ids': [], 'scanned_at': 0}
+    with open(cursor_file, "r") as f:
+        return json.load(f)
+
+# Saves the cursor. Only the ids of the flows inside the overlap window are kept, older flows
+# will never be returned again by Cyber Vision
+def save_cursor(last_activity, flow_ids):
+    cursor = {
+        'last_activity': last_activity,
+        'flow_ids': sorted(i for i, activity in flow_ids.items() if activity >= last_activity - cursor_overlap),
+        'scanned_at': current_ms()
+    }
+    with open(cursor_file, "w") as f:
+        f.write(json.dumps(cursor, indent=2))
+
+# Gets the 'from'/'to' parameters for the flow requests, combining the period in the env file
+# (if any) with the cursor of the previous scan
+def get_time_window(cursor, days=None):
+    now = current_ms()
+    start = 0
+    if days:
+        start = now - (int(days) * 86400000)
+    if cursor['last_activity']:
+        start = max(start, cursor['last_activity'] - cursor_overlap)
+    if not start:
+        return {}
+    return {'from': start, 'to': now}
+
+# Returns True if the flow is tagged as DNS, works on the flows of the list and on the flow details
+def has_dns_tag(flow):
+    tags = flow.get('tags') or []
+    return len(tags) > 0 and tags[0]['id'] == 'DNS'
+
+# Gets the ids of all the flows within the time window, with their first activity and whether they are DNS flows
+def list_flows(params):
+    client = get_cybervision_client()
+    response = client.get(base_url + "/flows/", headers=headers, params=params)
+    if response.status_code != 200:
+        print("HTTP Error", response.status_code, "ENCOUNTERED")
+        return None
+    return {flow['id']: {'activity': flow.get('firstActivity', 0), 'dns': has_dns_tag(flow)} for flow in response.json()}
+
+# Gets the details (domain, IPs, first activity) of a single flow from Cyber Vision
+def request_flow(flow):
+    response = get_cybervision_client().get(base_url + "/flows/" + flow, headers=headers)
+    if response.status_code != 200:
+        print("HTTP Error", response.status_code, "ENCOUNTERED for flow", flow)
+        return None
+    return response.json()
+
+# Gets the details of a single flow, from the flow cache if it has already been retrieved
+def get_flow(flow):
+    return get_flow_cache().get_or_fetch(flow, request_flow)
+
+# Returns True if the flow carries DNS queries
+def is_dns_flow(details):
+    return has_dns_tag(details) and len(details.get('properties') or []) > 0
+
+
+# Records the public IPs of both sides of a flow, with the first activity of the flow
+def add_public_ips(first_seen, details, activity):
+    # IPv6 is left out as the proceeding workflows are not compatible
+    ips = [(details.get(side) or {}).get('ip') or "" for side in ['left', 'right']]
+    for ip, public in zip(ips, classify_public(ips)):
+        if public:
+            record_first_seen(first_seen, ip, activity)
+
+
+def scan_flows(days=None):
+    """ Walks the new flows once and appends the DNS records and the public IPs to the pending files
+
+    Parameters
+    ----------
+    days: int
+        Only look at the flows of the last days, all the flows newer than the cursor if not given
+    """
+    cursor = load_cursor()
+    params = get_time_window(cursor, days)
+    seen_flows = set(cursor['flow_ids'])
+
+    flows = list_flows(params)
+    if flows is None:
+        return False
+
+    # Flows seen in the previous scan that are still inside the overlap window
+    flow_ids = {flow: cursor['last_activity'] for flow in seen_flows}
+    last_activity = cursor['last_activity']
+    # They have already been processed, the cursor can move past them (e.g. when it was held back by a failed flow)
+    for flow in seen_flows.intersection(flows):
+        flow_ids[flow] = int(flows[flow]['activity'])
+        last_activity = max(last_activity, flow_ids[flow])
+
+    # Records are appended, the pending files may still hold records that a task has not read yet
+    writers = {}
+    if 'dns' in scan_outputs:
+        writers['dns'] = RecordWriter(PENDING_FILES['dns'], append=True)
+    first_seen = {} if 'ips' in scan_outputs else None
+
+    new_flows = [flow for flow in flows if flow not in seen_flows]
+    if first_seen is None:
+        # Without the IP output only the DNS flows are requested, the others just move the cursor forward
+        for flow in new_flows:
+            activity = int(flows[flow]['activity'])
+            if not flows[flow]['dns'] and not (params and activity < params['from']):
+                flow_ids[flow] = activity
+                last_activity = max(last_activity, activity)
+        new_flows = [flow for flow in new_flows if flows[flow]['dns']]
+
+    # First activity of the flows whose details could not be retrieved
+    failed = []
+    for flow, details in fetch_concurrently(new_flows, get_flow):
+        if details is None:
+            failed.append(int(flows[flow]['activity']))
+            continue
+        activity = int(details['firstActivity'])
+
+        # Flows outside of the window are ignored, in case the server did not apply the filter
+        if params and activity < params['from']:
+            continue
+
+        if 'dns' in writers and is_dns_flow(details):
+            writers['dns'].write({
+                'domain': details['properties'][0]['value'],
+                'time': convert_to_time(activity),
+                'IP': details['left']['ip']
+            })
+
+        if first_seen is not None:
+            add_public_ips(first_seen, details, activity)
+
+        flow_ids[flow] = activity
+        last_activity = max(last_activity, activity)
+
+    # The cursor does not move past a flow that could not be retrieved, it is requested again on the next scan
+    if failed:
+        print(str(len(failed)) + " flows could not be retrieved, they will be retried on the next scan")
+        last_activity = min(last_activity, min(failed))
+
+    # Flush the files to disk once, before moving the cursor forward
+    for writer in writers.values():
+        writer.close()
+    if first_seen is not None:
+        # IPs not read yet by TASK_1_2 keep their earliest activity
+        pending = load_first_seen(PENDING_FILES['ips'])
+        save_first_seen(PENDING_FILES['ips'], merge_first_seen(pending, first_seen))
+    save_cursor(last_activity, flow_ids)
+
+    flow_cache = get_flow_cache()
+    flow_cache.commit()
+    flow_cache.print_stats()
+    return True
+
+
+def collect_public_ips(days):
+    """ Returns the first activity of every public IP of the flows of the last days, as a {ip: first activity} map,
+    whether or not the flows have been scanned before. None if the flows could not be listed
+
+    Parameters
+    ----------
+    days: int
+        Only look at the flows of the last days
+    """
+    params = get_time_window({'last_activity': 0}, days)
+    flows = list_flows(params)
+    if flows is None:
+        return None
+
+    first_seen = {}
+    failed = 0
+    for flow, details in fetch_concurrently(list(flows), get_flow):
+        if details is None:
+            failed += 1
+            continue
+        activity = int(details['firstActivity'])
+        if params and activity < params['from']:
+            continue
+        add_public_ips(first_seen, details, activity)
+    if failed:
+        print(str(failed) + " flows could not be retrieved, their IPs will be checked on the next run")
+
+    flow_cache = get_flow_cache()
+    flow_cache.commit()
+    flow_cache.print_stats()
+    return first_seen
+
+
+def defer_public_ips(first_seen):
+    """ Adds public IPs back to the pending IP file, so that the next TASK_1_2 run checks them again. Does nothing in
+    'period' mode, where every run checks all the IPs of the period
+
+    Parameters
+    ----------
+    first_seen: dict
+        {ip: first activity in milliseconds}
+    """
+    if not first_seen or 'ips' not in scan_outputs:
+        return 0
+    pending = load_first_seen(PENDING_FILES['ips'])
+    save_first_seen(PENDING_FILES['ips'], merge_first_seen(pending, first_seen))
+    return len(first_seen)
+
+
+def take_pending(output, path, days=None):
+    """ Copies the records waiting for a task to the given path. They are moved to a taken file, so the next scan
+    starts a new pending file, and kept there until the task calls commit_pending()
+
+    Parameters
+    ----------
+    output: str
+        'dns' for the DNS records (TASK_1_1) or 'ips' for the public IPs (TASK_1_2)
+    path: str
+        Where the records are copied to
+    days: int
+        Period passed to scan_flows if the flows have to be scanned again
+
+    Returns False if the flows could not be scanned
+    """
+    cursor = load_cursor()
+    if not os.path.exists(PENDING_FILES[output]) or current_ms() - cursor.get('scanned_at', 0) > max_age:
+        if not scan_flows(days):
+            return False
+
+    pending = PENDING_FILES[output]
+    taken = pending + ".taken"
+    if os.path.exists(pending):
+        if os.path.exists(taken):
+            # The previous run of the task stopped before the end, its records are taken again along with the new ones
+            if output == 'ips':
+                save_first_seen(taken, merge_first_seen(load_first_seen(taken), load_first_seen(pending)))
+            else:
+                with RecordWriter(taken, append=True) as writer:
+                    for record in read_records(pending):
+                        writer.write(record)
+            os.remove(pending)
+        else:
+            os.replace(pending, taken)
+
+    if os.path.exists(taken):
+        shutil.copyfile(taken, path)
+    elif output == 'ips':
+        # This output is disabled in the env file
+        save_first_seen(path, {})
+    else:
+        RecordWriter(path).close()
+    taken_outputs.add(output)
+    return True
+
+
+def commit_pending(output):
+    """ Removes the records taken by take_pending(), once the task has processed them. Does nothing if they have not
+    been taken by this run
+
+    Parameters
+    ----------
+    output: str
+        'dns' or 'ips'
+    """
+    taken = PENDING_FILES[output] + ".taken"
+    if output in taken_outputs and os.path.exists(taken):
+        os.remove(taken)
+    taken_outputs.discard(output)
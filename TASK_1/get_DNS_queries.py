@@ -15,12 +15,13 @@ or implied.
 # THIS SCRIPT SIMPLY TAKES THE JSON FILE THAT CONTAINS THE INFORMATION
 # ABOUT THE DOMAINS, IPs, AND DATES, AND STORES IT AS A PYTHON
 # DICTIONARY
+# THE RECORDS ARE READ LAZILY, ONE AT A TIME, SO THE WHOLE FILE IS NEVER
+# LOADED INTO MEMORY (NDJSON FILES ONLY, THE OLDER JSON LIST IS STILL READ AT ONCE)
 
-import json
+from ndjson_io import read_records
 
 def get_DNS_queries():
 
-    file = open("domains_urls.json", "r")
-    domains_list = json.load(file)
+    domains_list = read_records("domains_urls.json")
 
     return domains_list
\ No newline at end of file
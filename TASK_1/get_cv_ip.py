@@ -28,14 +28,17 @@ range prior to the current date to be filtered.
 - convert_to_time: converts the millisecond datetime to yyyy/mm/dd 
     hr/min/sec for legibility. 
 - isItPublic: returns whether an IP address is IPv4 AND public AND not 
-    a reserved IP, exceptions to the rule may have been missed.
-- getIps: gathers flows from a defined period, writing the first 
+    a reserved IP, using the precompiled tables of ip_classifier.py.
+- getIps: gathers the public IPs of the flows from a defined period 
+    (walked once for both tasks by flow_scan.py), writing the first 
     appearance datetime and IP addresses to a list of dictionaries.
 """
 
-import requests 
 import json 
 import env as config
+from flow_scan import take_pending, collect_public_ips, scan_settings
+from first_seen import load_first_seen
+from ip_classifier import is_public
 from datetime import datetime
 
 # Converts current time to milliseconds to pass within the API calls
@@ -56,89 +59,33 @@ def isItPublic(stringIp):
     Is this IP address public?
     Parameters: string IP address of format "0.0.0.0" - "255.255.255.255"
     If IPv4, public, and not reserved return True, else return False.
+    The reserved ranges are the IANA special-purpose blocks, see 
+    ip_classifier.py.
     """
-    # Private IPs
-    if stringIp[0:3] == "10.":
-        return False
-    for i in range(16, 32):
-        check = "172." + str(i) + "."
-        if stringIp[0:7] == check:
-            return False
-    if stringIp[0:8] == "192.168.":
-        return False
-    # Current networks / Source addresses.
-    if stringIp[0] == "0":
-        return False
-    # Shared address space for SP to subscribers through carrier-grade NAT.
-    for i in range(64, 128):
-        check = "100." + str(i) + "."
-        if i < 100:
-            if stringIp[0:7] == check:
-                return False
-        else:
-            if stringIp[0:8] == check:
-                return False
-    # Loopback addresses to local host.
-    if stringIp[0:3] == "127":
-        return False
-    # Link-local addresses between two hosts on a single link when no 
-    # IP address is specified.
-    if stringIp[0:7] == "169.254":
-        return False
-    # IETF protocol assignments.
-    if stringIp[0:7] == "192.0.0":
-        return False
-    # TEST-NET-1 documentation and examples.
-    if stringIp[0:7] == "192.0.2":
-        return False
-    # Reserved 6to4 Relay Anycast.
-    if stringIp[0:9] == "192.88.99":
-        return False
-    # Network Interconnect Device Benchmark Testing.
-    for i in range(18, 20):
-        check = "198." + str(i) + "."
-        if stringIp[0:7] == check:
-            return False
-    # TEST-NET-2
-    if stringIp[0:11] == "198.51.100.":
-        return False
-    # TEST-NET-3
-    if stringIp[0:10] == "203.0.113.":
-        return False
-    # Reserved for future use.
-    for i in range(40, 56):
-        check = "2" + str(i) + "."
-        if stringIp[0:4] == check:
-            return False
-    # Broadcast IP.
-    if stringIp[0:15] == "255.255.255.255":
-        return False
     # Disallow IPv6 as the proceeding workflows are not compatible.
-    for p in stringIp:
-        if p == ":":
-            return False
-    # The address may be passed to the proceeding function.
-    return True
+    return is_public(stringIp, allow_ipv6=False)
 
 def get_ips():  
     """ 
     Search CV flows and return public IPs and their first appearance .
-    1. Gather flows with capacity limited by a period of days, creating 
-        a list of IDs.
-    2. Loop through the list of flow IDs and pass the IDs into GET 
-        requests.
-    3. Parse each response and extract the IP address and first activity 
-        timestamp of the Left and Right node, the lists are merged, duplicates 
-        are avoided.
-    4. Convert the timestamp into datetime format, store each IP and 
-        firstActivity in a list of dictionaries 
-    5. Returned as a list of dictionaries. 
+    1. Take the public IPs collected by the flow scan (flow_scan.py), 
+        the flows are scanned again unless a recent scan (e.g. from 
+        TASK_1_1) has already collected them. They are kept by the scan 
+        until TASK_1_2 has processed them (see commit_pending()). The scan is limited by a 
+        period of days and only requests the flows it has not seen yet,
+        so an IP is only returned when it appears in a new flow. If 
+        SCAN['ips_mode'] is 'period' in env.py, the IPs of all the 
+        flows of the period are returned on every run instead.
+    2. The scan keeps each IP address once, with the earliest first 
+        activity timestamp of the Left and Right node of its flows.
+    3. Convert the timestamp into datetime format, store each IP and 
+        firstActivity in a list of dictionaries, along with the 
+        timestamp ('activity') to put back the IPs that could not be 
+        checked (see ip_get_domain.py) 
+    4. Returned as a list of dictionaries. 
     """
 
-    base_url = config.CYBERVISION["base_url"]
-    my_token = config.CYBERVISION["x-token-id"]
     ip_collection = []
-    flows_id, ip_list, ip_seen = [], [], []
     days = config.PERIOD['period']
     now = int(current_t().total_seconds()) * 1000
 
@@ -147,54 +94,32 @@ def get_ips():
     if not days or not str(days).isdigit() or days < 0 or (now - (days*86400000)) <= 0 or days >= current_t().days:
         print("Please check that the environmental variable 'PERIOD' is an integer greater than 0 but less than " + str(current_t().days)+ ".")
     else:
-        
-        params = {
-            "from" : (now - (days*86400000)),
-            "to" : now
-        }
-        headers = {
-            "x-token-id" : my_token
-        }
-        payload = {}
-        endpoint_url = "flows/"
 
-        # Gather Flow IDs, a set period prior from the current date is tested, 
-        # this is configured within the environment variables
-        response = requests.get(url=base_url+endpoint_url, headers=headers, 
-                                params=params, verify=False)
-        data = response.json()
-        for f in data:
-            flows_id.append(f['id'])
+        if scan_settings.get('ips_mode', 'new') == 'period':
+            # Public IPs of all the flows of the period, checked again on 
+            # every run
+            ip_seen = collect_public_ips(days)
+            if ip_seen is None:
+                return ip_collection
+        else:
+            # Public IPs of the flows seen since the previous scan, a set 
+            # period prior from the current date is tested, this is 
+            # configured within the environment variables
+            if not take_pending('ips', "public_ips.json", days):
+                return ip_collection
 
-        # Access IP's used in Left-Right Flows, filter for Public addressess 
-        # only, merge.
-        flow_sides = ['left', 'right']
-        for a in flows_id:
-            response = requests.get(url=base_url+endpoint_url+a, 
-                                    headers=headers, params=params, 
-                                    verify=False)
-            data = response.json()
-            for s in flow_sides:
-                try:
-                    if isItPublic(data[s]['ip']):
-                        if not (data[s]['ip'] in ip_list):
-                            ip_list.append(data[s]['ip'])
-                            ip_seen.append(data['firstActivity'])
-                        elif (data[s]['ip'] in ip_list and int(ip_seen[ip_list.index(data[s]['ip'])]) > int(data['firstActivity'])):
-                            ip_seen[ip_list.index(data[s]['ip'])] = data['firstActivity']
-                except Exception as e:
-                    pass 
-                    # Catches the exception when no key named 'IP' is found.
+            # IP's used in Left-Right Flows, already merged by the scan.
+            ip_seen = load_first_seen("public_ips.json")
 
         # Convert time after merger, append to IP-time pairs to a list of 
         # dictionaries.
-        for n in ip_list:
+        for n, activity in ip_seen.items():
             ip_collection.append(
                 {
                     'ip' : n, 
-                    'firstActivity' : convert_to_time(ip_seen[ip_list.index(n)])
+                    'firstActivity' : convert_to_time(activity),
+                    'activity' : activity
                 }
             )
 
         return ip_collection
-
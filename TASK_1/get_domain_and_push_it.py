@@ -16,94 +16,39 @@ or implied.
 
 '''
 This script integrates the reputation gathered from Umbrella with the processing of the events. The word "processing" here
-means adding the DNS query into the domains_DB, which is the json file that includes the malicious domains that have been queried
+means adding the DNS query into the domains_DB, which is the database that includes the malicious domains that have been queried
+(a SQLite file with an index on the domain, see domains_store.py, or a log of changes, see domains_log.py)
 
-This script is divided into 3 functions:
+This script is divided into 2 functions:
 - Funcion 1 (store_info()):
-    DESCRIPTION: stores the modified information of the domains in a separate json file (that constantly updates itself)
-    INPUTS (1): Python structure that contains the information about the domains
-
-- Function 2 (get_position()):
-    DESCRIPTION: gets the index position of a specific domain inside the domains_DB structure, which is the data coming from the json file
-        that contains the information about the domains, IPs, and dates (the reason will be better understood in the integration_process() function)
-    INPUTS (2): domain that wants to be checked, domains_DB
-    OUTPUTS (1): index position of the specific domain
-
-- Function 3 (integration_process()):
-    DESCRIPTION: first, it checks whether this is the first time that the malicious domain has been queried. If it is, the domain is added as a new
-        one into the database. If it is not, the database is updated with the new information
-    INPUTS (2): domain to be treated, domains_DB
-    OUTPUTS (1): add information from the new domain into the domains_DB structure (and consequently the json file)
+    DESCRIPTION: saves the modified information of the domains into the database, once per run
+    INPUTS (1): domains_DB
+
+- Function 2 (integration_process()):
+    DESCRIPTION: adds every DNS query of the list into the database. A domain queried for the first time is added as a new
+        one, otherwise its count and rollups are updated. All the changes are saved at once with store_info()
+    INPUTS (2): list of DNS queries to be treated, domains_DB
+    OUTPUTS (1): add information from the new domain into the domains_DB
 '''
 
 import requests
 import json
 from pprint import pprint
-
-# Import the functions from other scripts
-from get_reputation import get_reputation
-
-def check_domain(domain, domains_DB):
-
-    # Assume that it is the first time queried, set the variable to 1 (YES)
-    first_time = 1
-    for item in domains_DB:
-        if item["domain"] == domain:
-            # If the DNS has been queried previously, set the variable to 0 (NO)
-            first_time = 0
-
-    return first_time
-
-file = open('domains_DB.json',)
-domains_DB = json.load(file)
+from domains_store import get_domains_store
 
 ## FUNCTION
-# Store the domain, IP and date in the database (domains_DB file)
+# Store the domain, IP and date in the database (domains_DB), all the changes of the run at once
 def store_info(domains_DB):
-    with open("domains_DB.json", "w") as file:
-        json.dump(domains_DB, file, ensure_ascii=False, indent=4)
+    domains_DB.commit()
 
 ## FUNCTION
-# Get the index position of the domain that has been repeated
-def get_position(domain, domains_DB):
-    i = 0
-    for item in domains_DB["list"]:
-        if domain == item["domain"]:
-            index = i
-        i = i + 1
-    return index
-
-
-## FUNCTION
-def integration_process(domains_list, domains_DB):
+# Adds the DNS queries of the run into the database
+def integration_process(domains_list, domains_DB=None):
+    if domains_DB is None:
+        domains_DB = get_domains_store()
     for item in domains_list:
-        first_time_appeared = check_domain(item["domain"], domains_DB["list"])
-        
-        # First time that this domain has appeared
-        if first_time_appeared == 1:
-            # Get reputation from Umbrella, for the specific domain
-            reputation = get_reputation(item["domain"])
-            
-            # Store the domain, IP and date in the dictionary
-            new_domain = {}
-            new_domain["domain"] = item["domain"]
-            new_domain["count"] = 1
-            new_domain["queries"] = []
-            payload = {"IP" : item["IP"], "time" : item["time"]}
-            new_domain["queries"].append(payload)
-
-            domains_DB["list"].append(new_domain)
-
-        # NOT the first time that this domain has appeared
-        elif first_time_appeared == 0:
-            # Determine position of domain that is repeated
-            position = get_position(item["domain"], domains_DB)
-
-            domains_DB["list"][position]["count"] = domains_DB["list"][position]["count"] + 1
-            payload = {"IP" : item["IP"], "time" : item["time"]}
-            domains_DB["list"][position]["queries"].append(payload)
-
-        else:
-            print("Error inside the code, please check!")
+        # Adds the domain the first time that it appears, otherwise increases its count. In both cases the IP and
+        # date are stored
+        domains_DB.add_query(item["domain"], item["IP"], item["time"])
 
-        store_info(domains_DB)
\ No newline at end of file
+    store_info(domains_DB)
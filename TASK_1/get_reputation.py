@@ -16,96 +16,334 @@ or implied.
 
 '''
 This script gathers the Umbrella url and token in order to authenticate an be able to use the Umbrella Investigate API
+Every answer from Umbrella is kept in the reputation cache (see reputation_cache.py), and a domain that is in the cache
+is not checked again until its answer expires
+All the API calls go through the rate-limited Investigate client (see umbrella_client.py). A call that still fails after
+the retries raises UmbrellaError, instead of returning an error that would be read as a reputation. The functions that
+make API calls have an async version (ending in _async) that can be awaited from asyncio code
 
-Furthermore, this script is divided into 3 functions:
-- Funcion 1 (check_errors()):
-    DESCRIPTION: given the status code of an API request, it prints an error if it has not been successful
-    INPUTS (1): status code
-    OUTPUTS (0): prints a message
+Furthermore, this script is divided into 11 functions:
+- Funcion 1 (get_categorization()):
+    DESCRIPTION: makes an API request to the Umbrella API to get the status and the categories of a specific DNS query/domain,
+        and stores this information in the "query" dictionary
+    INPUTS (1): domain/DNS query
+    OUTPUTS (1): "query" dictionary
+
+- Function 2 (get_categorization_bulk() / get_categorization_bulk_async()):
+    DESCRIPTION: same as get_categorization(), for a list of domains. The domains are sent in chunks (of "bulk_size" in the
+        env file) in a single POST request each, instead of one request per domain, and the chunks are sent at the same
+        time. If a bulk request fails, the domains of that chunk are checked one by one. A domain that cannot be checked
+        is left out of the output, and added to the "unavailable" set if Investigate could not be reached (it may work
+        on a later run, unlike a domain that Investigate has no categorization for)
+    INPUTS (2): list of domains, optional set of the domains that could not be checked because of Investigate
+    OUTPUTS (1): dictionary with a "query" dictionary for each domain
+
+- Function 3 (get_risk_score() / get_risk_score_async()):
+    DESCRIPTION: makes an API request to get the Risk Score of a particular domain and stores it in the "query" dictionary
+    INPUTS (2): domain/DNS query, "query" dictionary
+    OUTPUTS (1): "query" dictionary
 
-- Function 2 (get_reputation()):
+- Function 4 (get_reputation() / get_reputation_async()):
     DESCRIPTION: first, it makes an API request to the Umbrella API to get all of the information that
         it can gather regarding a specific DNS query/domain. It stores this information in the "query" dictionary. Afterwards,
-        it makes a new API call to get the Risk Score of the particular domain, and also stores it in the "query" dictionary
+        only if the domain is malicious or unknown (see needs_risk_score()), it makes a new API call to get the Risk Score
+        of the particular domain, and also stores it in the "query" dictionary. Clean domains have no "url_risk_score"
     INPUTS (1): domain/DNS query
     OUTPUTS (1): "query" dictionary
 
-- Function 3 (get_reputation_list()):
-    DESCRIPTION: leverages the get_reputation() function to perform the Umbrella checks in a list of domains, instead of a
-        specific one
+- Function 5 (get_reputation_list() / get_reputation_list_async()):
+    DESCRIPTION: performs the Umbrella checks in a list of domains, instead of a specific one. The categorization is
+        done in bulk, the Risk Score is requested once for each different malicious/unknown domain, all at the same time.
+        The domains that could not be checked are left out
     INPUTS (1): list of domains to be checked
     OUTPUTS (1): list of responses for each domain
+
+- Function 6 (chunks()):
+    DESCRIPTION: splits a list into smaller lists of a given size
+    INPUTS (2): list, size
+    OUTPUTS (1): generator of lists
+
+- Function 7 (parse_categorization()):
+    DESCRIPTION: stores the relevant outputs of the categorization of a domain in the "query" dictionary
+    INPUTS (2): domain/DNS query, categorization returned by Umbrella for the domain
+    OUTPUTS (1): "query" dictionary
+
+- Functions 8 and 9 (request_categorization() / request_categorization_chunk() and request_risk_score()):
+    DESCRIPTION: the API calls (coroutines) made by the functions above, without going through the cache. When several
+        threads check the same domain at the same time with get_categorization() or get_risk_score(), only one of them
+        makes the call
+    INPUTS (1): domain/DNS query (or list of domains for request_categorization_chunk())
+    OUTPUTS (1): "query" dictionary / risk score
+
+- Function 10 (needs_risk_score()):
+    DESCRIPTION: tells whether the Risk Score of a domain is needed. Only malicious and unknown domains are turned into
+        Cyber Vision events (see create_event.py), so the Risk Score of clean domains is never requested
+    INPUTS (1): "query" dictionary
+    OUTPUTS (1): True/False
+
+- Function 11 (get_stale_reputation()):
+    DESCRIPTION: returns the last reputation of a domain kept in the cache, even if it has expired. Used when Investigate
+        cannot be reached (see circuit_breaker.py). get_categorization_bulk() does the same for the domains it could not
+        check
+    INPUTS (1): domain/DNS query
+    OUTPUTS (1): "query" dictionary, None if there is none
 '''
 
-import requests
-import json
+import asyncio
 import env
 from pprint import pprint
+from reputation_cache import get_reputation_cache, get_ttl, stats, coalesce
+from umbrella_client import get_umbrella_client, UmbrellaError, CircuitOpen
 
-# Retrieve the base URL and the token for authorization
-base_url = env.UMBRELLA["inv_url"]
-API_token = env.UMBRELLA["inv_token"]
+# Number of domains sent in each bulk categorization request
+bulk_size = int(env.UMBRELLA.get("bulk_size", 1000))
 
 
 ## FUNCTION
-# Checks for errors in API request
-def check_errors(status_code):
-    if status_code != 200:
-        print("Error " + str(status_code) + " in the API Request")
+# Splits a list into chunks of a given size
+def chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
 
 ## FUNCTION
-# Makes Umbrella Investigate API to check the DNS queries
-def get_reputation(domain):
+# Stores the relevant Umbrella outputs of a categorization response
+def parse_categorization(domain, categorization):
     query = {}
+    query["url_status"] = categorization["status"]
+    query["url_security_categories"] = categorization["security_categories"]
+    query["url_contentcategories"] = categorization["content_categories"]
+    query["domain"] = domain
+    return query
+
+## FUNCTION
+# Makes Umbrella Investigate API call to get the categorization of a DNS query
+def get_categorization(domain):
+    cache = get_reputation_cache()
+    query = cache.get(domain)
+    if query is not None:
+        stats["saved_calls"] += 1
+        return dict(query)
+
+    # If another thread is already checking this domain, wait for its answer
+    query = coalesce(("categorization", domain),
+                     lambda: get_umbrella_client().run(request_categorization(domain)))
+    cache.put(domain, query, get_ttl(query))
+    return dict(query)
+
+## FUNCTION
+# Makes Umbrella Investigate API call to get the categorization of a DNS query, without the cache
+async def request_categorization(domain):
 
     # API call for CATEGORIZATION
-    url = base_url + "/domains/categorization/" + domain + "?showLabels"
-    headers = {"Authorization": "Bearer " + API_token}
-    response = requests.get(url, headers=headers)
-    response_json = json.loads(response.text)
-        
-    # Check for possible Request errors
-    check_errors(response.status_code)
+    response_json = await get_umbrella_client().arequest("GET", "/domains/categorization/" + domain + "?showLabels")
+    stats["api_calls"] += 1
 
     # Get relevant Umbrella outputs
-    query["url_status"] = response_json[domain]["status"]
-    query["url_security_categories"] = response_json[domain]["security_categories"]
-    query["url_contentcategories"] = response_json[domain]["content_categories"]
-    
+    try:
+        return parse_categorization(domain, response_json[domain])
+    except (KeyError, TypeError):
+        # Investigate answered, asking again will not help
+        raise UmbrellaError("No categorization returned for " + domain, 200)
 
-    # API call for RISK SCORE
-    url = base_url + "/domains/risk-score/" + domain
-    headers = {"Authorization": "Bearer " + API_token}
-    response = requests.get(url, headers=headers)
-    response_json = json.loads(response.text)
+## FUNCTION
+# Gets the categorization of one chunk of DNS queries, in a single bulk request. The domains that could not be checked
+# because Investigate could not be reached are added to unavailable
+async def request_categorization_chunk(chunk, unavailable=None):
+    categorizations = {}
+    try:
+        # API call for CATEGORIZATION, the body is a json list of domains
+        response_json = await get_umbrella_client().arequest("POST", "/domains/categorization?showLabels", json=chunk)
+        stats["api_calls"] += 1
+    except UmbrellaError as e:
+        print("Bulk categorization failed: " + str(e))
+        response_json = {}
 
-    # Check for possible Request errors
-    check_errors(response.status_code)
+    for domain in chunk:
+        try:
+            categorizations[domain] = parse_categorization(domain, response_json[domain])
+        except (KeyError, TypeError):
+            # Domain missing from the bulk answer, check it on its own
+            try:
+                categorizations[domain] = await request_categorization(domain)
+            except UmbrellaError as e:
+                # The domain is left out of the answer
+                if e.is_transient() and unavailable is not None:
+                    unavailable.add(domain)
+                if not isinstance(e, CircuitOpen):
+                    print("Could not categorize " + domain + ": " + str(e))
+    return categorizations
 
-    # Extract relevant information from Umbrella
-    query["url_risk_score"] = response_json["risk_score"]
+## FUNCTION
+# Gets the categorization of many DNS queries, sending them in bulk requests (async version)
+async def get_categorization_bulk_async(domains, unavailable=None):
+    categorizations = {}
 
-    # Add domain that we are talking about
-    query["domain"] = domain
+    # Remove duplicates, keeping the order, and get the domains that are in the cache
+    cache = get_reputation_cache()
+    missing = []
+    for domain in dict.fromkeys(domains):
+        query = cache.get(domain)
+        if query is not None:
+            stats["saved_calls"] += 1
+            categorizations[domain] = dict(query)
+        else:
+            missing.append(domain)
+
+    # All the chunks are requested at the same time, the client keeps them within the rate limit
+    answers = await asyncio.gather(*[request_categorization_chunk(chunk, unavailable) for chunk in chunks(missing, bulk_size)])
+    for answer in answers:
+        for domain, query in answer.items():
+            categorizations[domain] = query
+            cache.put(domain, query, get_ttl(query))
+
+    # The domains that Investigate could not check keep their last verdict, even if it has expired
+    stale = 0
+    for domain in missing:
+        if domain not in categorizations:
+            query = cache.get_stale(domain)
+            if query is not None:
+                categorizations[domain] = dict(query)
+                stale += 1
+    if stale:
+        print(str(stale) + " domains checked with an expired verdict from the cache, Investigate could not be reached")
+
+    return categorizations
+
+## FUNCTION
+# Gets the categorization of many DNS queries, sending them in bulk requests
+def get_categorization_bulk(domains, unavailable=None):
+    return get_umbrella_client().run(get_categorization_bulk_async(domains, unavailable))
+
+## FUNCTION
+# Makes Umbrella Investigate API call to get the Risk Score of a DNS query
+def get_risk_score(domain, query):
+
+    # The risk score is stored in the cache along with the categorization
+    cache = get_reputation_cache()
+    cached = cache.get(domain)
+    if cached is not None and "url_risk_score" in cached:
+        stats["saved_calls"] += 1
+        query["url_risk_score"] = cached["url_risk_score"]
+        return query
+
+    # If another thread is already checking this domain, wait for its answer
+    query["url_risk_score"] = coalesce(("risk-score", domain),
+                                       lambda: get_umbrella_client().run(request_risk_score(domain)))
+    cache.put(domain, query, get_ttl(query))
 
     return query
 
+## FUNCTION
+# Makes Umbrella Investigate API call to get the Risk Score of a DNS query (async version)
+async def get_risk_score_async(domain, query):
+    cache = get_reputation_cache()
+    cached = cache.get(domain)
+    if cached is not None and "url_risk_score" in cached:
+        stats["saved_calls"] += 1
+        query["url_risk_score"] = cached["url_risk_score"]
+        return query
+
+    query["url_risk_score"] = await request_risk_score(domain)
+    cache.put(domain, query, get_ttl(query))
+
+    return query
+
+## FUNCTION
+# Makes Umbrella Investigate API call to get the Risk Score of a DNS query, without the cache
+async def request_risk_score(domain):
+
+    # API call for RISK SCORE
+    response_json = await get_umbrella_client().arequest("GET", "/domains/risk-score/" + domain)
+    stats["api_calls"] += 1
+
+    # Extract relevant information from Umbrella
+    try:
+        return response_json["risk_score"]
+    except (KeyError, TypeError):
+        raise UmbrellaError("No risk score returned for " + domain, 200)
+
+## FUNCTION
+# Makes Umbrella Investigate API to check the DNS queries
+def get_reputation(domain):
+    query = get_categorization(domain)
+
+    # Clean domains are never pushed to Cyber Vision, their Risk Score is not needed
+    if not needs_risk_score(query):
+        stats["saved_calls"] += 1
+        return query
+
+    return get_risk_score(domain, query)
+
+## FUNCTION
+# Makes Umbrella Investigate API to check the DNS queries (async version)
+async def get_reputation_async(domain):
+    cache = get_reputation_cache()
+    query = cache.get(domain)
+    if query is not None:
+        stats["saved_calls"] += 1
+        query = dict(query)
+    else:
+        query = await request_categorization(domain)
+        cache.put(domain, query, get_ttl(query))
+
+    if not needs_risk_score(query):
+        stats["saved_calls"] += 1
+        return query
+
+    return await get_risk_score_async(domain, query)
+
+## FUNCTION
+# Last reputation of a DNS query kept in the cache, even if it has expired, used when Investigate cannot be reached.
+# Returns None if there is none or it has no Risk Score while it needs one
+def get_stale_reputation(domain):
+    query = get_reputation_cache().get_stale(domain)
+    if query is None or (needs_risk_score(query) and "url_risk_score" not in query):
+        return None
+    return dict(query)
+
+## FUNCTION
+# Only the malicious and unknown domains, the ones that become Cyber Vision events, need a Risk Score
+def needs_risk_score(query):
+    return query["url_status"] in [-1, 0]
+
 
 ## FUNCTION
 # Run DNS checking in multiple DNS queries
 def get_reputation_list(domain_list):
+    return get_umbrella_client().run(get_reputation_list_async(domain_list))
+
+## FUNCTION
+# Run DNS checking in multiple DNS queries (async version). Domains that could not be checked are left out
+async def get_reputation_list_async(domain_list):
     umbrella_response = []
 
+    # Get the categorization of all the DNS domains in bulk
+    categorizations = await get_categorization_bulk_async([item["domain"] for item in domain_list])
+
+    # Clean domains keep their categorization only
+    domains = [domain for domain in dict.fromkeys(item["domain"] for item in domain_list) if domain in categorizations]
+    queries = {domain: categorizations[domain] for domain in domains if not needs_risk_score(categorizations[domain])}
+    stats["saved_calls"] += len(queries)
+
+    # Get the risk score from Umbrella once for each different malicious/unknown DNS domain, all at the same time
+    domains = [domain for domain in domains if domain not in queries]
+    answers = await asyncio.gather(*[get_risk_score_async(domain, dict(categorizations[domain])) for domain in domains],
+                                   return_exceptions=True)
+    for domain, query in zip(domains, answers):
+        if isinstance(query, UmbrellaError):
+            print("Could not get the risk score of " + domain + ": " + str(query))
+        elif isinstance(query, BaseException):
+            raise query
+        else:
+            queries[domain] = query
+
     for item in domain_list:
-        # Get output from Umbrella for each DNS domain
-        query = get_reputation(item["domain"])
-        
-        # Store Umbrella response in Python dictionary
-        umbrella_response.append(query)
+        if item["domain"] in queries:
+            # Store Umbrella response in Python dictionary
+            umbrella_response.append(dict(queries[item["domain"]]))
 
     return umbrella_response
 
-
 # Example to test code
 '''
 # Test code to check functions
@@ -0,0 +1,146 @@
+"""
+Copyright (c) 2021 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+"""
+Classifies IP addresses as public or reserved.
+The IANA special-purpose IPv4 and IPv6 blocks (plus multicast) are
+converted once, at import, into sorted tables of integer ranges. An
+address is parsed into an integer and looked up with a binary search,
+instead of being compared against string prefixes.
+- is_public: returns whether a single IP address is public.
+- classify_public: returns the same answer for a whole list of
+    addresses at once.
+"""
+
+import socket
+from bisect import bisect_right
+from ipaddress import ip_network
+
+# IANA IPv4 Special-Purpose Address Registry, plus multicast.
+RESERVED_IPV4 = [
+    "0.0.0.0/8",            # Current network / source addresses.
+    "10.0.0.0/8",           # Private network.
+    "100.64.0.0/10",        # Shared address space (carrier-grade NAT).
+    "127.0.0.0/8",          # Loopback.
+    "169.254.0.0/16",       # Link-local.
+    "172.16.0.0/12",        # Private network.
+    "192.0.0.0/24",         # IETF protocol assignments.
+    "192.0.2.0/24",         # TEST-NET-1 documentation and examples.
+    "192.31.196.0/24",      # AS112-v4.
+    "192.52.193.0/24",      # AMT.
+    "192.88.99.0/24",       # Reserved 6to4 relay anycast.
+    "192.168.0.0/16",       # Private network.
+    "192.175.48.0/24",      # Direct delegation AS112 service.
+    "198.18.0.0/15",        # Network interconnect device benchmark testing.
+    "198.51.100.0/24",      # TEST-NET-2.
+    "203.0.113.0/24",       # TEST-NET-3.
+    "224.0.0.0/4",          # Multicast.
+    "240.0.0.0/4",          # Reserved for future use, includes broadcast.
+]
+
+# IANA IPv6 Special-Purpose Address Registry, plus multicast.
+RESERVED_IPV6 = [
+    "::/128",               # Unspecified address.
+    "::1/128",              # Loopback.
+    "::ffff:0:0/96",        # IPv4-mapped addresses.
+    "64:ff9b::/96",         # IPv4-IPv6 translation.
+    "64:ff9b:1::/48",       # Local-use IPv4/IPv6 translation.
+    "100::/64",             # Discard-only address block.
+    "2001::/23",            # IETF protocol assignments.
+    "2001:db8::/32",        # Documentation.
+    "2002::/16",            # 6to4.
+    "3fff::/20",            # Documentation.
+    "5f00::/16",            # Segment routing (SRv6) SIDs.
+    "fc00::/7",             # Unique-local.
+    "fe80::/10",            # Link-local unicast.
+    "ff00::/8",             # Multicast.
+]
+
+
+def _build_table(blocks):
+    """
+    Converts a list of CIDR blocks into two sorted lists, the first and
+    last integer address of each range, merging the ranges that overlap.
+    """
+    ranges = sorted((int(n.network_address), int(n.broadcast_address))
+                    for n in map(ip_network, blocks))
+    starts, ends = [], []
+    for start, end in ranges:
+        if ends and start <= ends[-1] + 1:
+            ends[-1] = max(ends[-1], end)
+        else:
+            starts.append(start)
+            ends.append(end)
+    return starts, ends
+
+_IPV4_STARTS, _IPV4_ENDS = _build_table(RESERVED_IPV4)
+_IPV6_STARTS, _IPV6_ENDS = _build_table(RESERVED_IPV6)
+
+
+def is_public(stringIp, allow_ipv6=False):
+    """
+    Is this IP address public?
+    Parameters: string IP address, IPv4 or IPv6. IPv6 addresses are
+    only accepted if allow_ipv6 is True.
+    If valid, public, and not reserved return True, else return False.
+    """
+    try:
+        if ":" not in stringIp:
+            value = int.from_bytes(socket.inet_pton(socket.AF_INET, stringIp), "big")
+            starts, ends = _IPV4_STARTS, _IPV4_ENDS
+        elif allow_ipv6:
+            value = int.from_bytes(socket.inet_pton(socket.AF_INET6, stringIp), "big")
+            starts, ends = _IPV6_STARTS, _IPV6_ENDS
+        else:
+            return False
+    except (OSError, TypeError):
+        # Not a valid IP address.
+        return False
+
+    # Index of the last reserved range starting at or before the address.
+    i = bisect_right(starts, value) - 1
+    return i < 0 or value > ends[i]
+
+
+def classify_public(ips, allow_ipv6=False):
+    """
+    Classifies a whole list of addresses at once.
+    Parameters: list of string IP addresses.
+    Returns a list of booleans, True for the public addresses, in the
+    same order as the input.
+    """
+    pton, af_inet, af_inet6 = socket.inet_pton, socket.AF_INET, socket.AF_INET6
+    from_bytes, search = int.from_bytes, bisect_right
+    v4_starts, v4_ends = _IPV4_STARTS, _IPV4_ENDS
+    v6_starts, v6_ends = _IPV6_STARTS, _IPV6_ENDS
+
+    result = []
+    for ip in ips:
+        try:
+            if ":" not in ip:
+                value = from_bytes(pton(af_inet, ip), "big")
+                i = search(v4_starts, value) - 1
+                result.append(i < 0 or value > v4_ends[i])
+            elif allow_ipv6:
+                value = from_bytes(pton(af_inet6, ip), "big")
+                i = search(v6_starts, value) - 1
+                result.append(i < 0 or value > v6_ends[i])
+            else:
+                result.append(False)
+        except (OSError, TypeError):
+            result.append(False)
+    return result
@@ -24,55 +24,115 @@ IPv4 address resides, and 'firstActivity' where the address was first
 seen. 
 The output is a returned list of dictionaries containing the IP, first 
 activity, and malicious domains associated with the IP. 
-The is additionally written to a .json file. If there are no malicious 
-domains the output returns an empty list. 
+The is additionally written to a .json file, once all the IPs have been 
+checked. If there are no malicious domains the output returns an empty 
+list. 
+The IPs are looked up at the same time, through the rate-limited 
+Investigate client (see umbrella_client.py). An IP that cannot be 
+checked because Investigate could not be reached is put back in the 
+pending IP file of the flow scan (see flow_scan.py), so the next run 
+checks it again, the other ones are skipped. The answer for each IP, including the IPs with no 
+domains, is kept in a cache (IP_DOMAINS_CACHE in env.py) so it is not 
+requested again on the next runs. 
 """
 
-import requests 
+import asyncio
 import json 
+import threading
 import env as config
+from ttl_cache import TTLCache
+from umbrella_client import get_umbrella_client, UmbrellaError
+from first_seen import record_first_seen
+from flow_scan import defer_public_ips
+
+settings = getattr(config, "IP_DOMAINS_CACHE", {})
+_ip_cache = None
+_lock = threading.Lock()
+
+# Returns the cache of the domains seen on each IP, shared by all the 
+# scripts. 
+def get_ip_cache():
+    global _ip_cache
+    with _lock:
+        if _ip_cache is None:
+            _ip_cache = TTLCache(settings.get("file", "reputation_cache.sqlite"), "ip_domains",
+                                 int(settings.get("memory_entries", 10000)))
+        return _ip_cache
+
+# Returns the list of domains that Umbrella has recently seen on an 
+# IPv4 address (sync version). 
+def ip_latest_domains(ip):
+    return get_umbrella_client().run(ip_latest_domains_async(ip))
+
+# Returns the list of domains that Umbrella has recently seen on an 
+# IPv4 address, to be awaited from asyncio code. The answer comes from 
+# the cache if the IP has been checked recently. Raises UmbrellaError 
+# if the request fails. 
+async def ip_latest_domains_async(ip):
+    cache = get_ip_cache()
+    domains = cache.get(ip)
+    if domains is not None:
+        return domains
+
+    data = await get_umbrella_client().arequest("GET", "/ips/"+ip+"/latest_domains")
+    domains = [m['name'] for m in data]
+    hours = settings.get("ttl_hours", 24) if domains else settings.get("ttl_empty_hours", 72)
+    cache.put(ip, domains, hours * 3600)
+    return domains
+
+# Looks up all the IPs at the same time. Returns a dictionary with the 
+# list of domains of each IP, or the UmbrellaError raised for it. 
+async def lookup_ips_async(ips):
+    ips = list(dict.fromkeys(ips))
+    answers = await asyncio.gather(*[ip_latest_domains_async(ip) for ip in ips], return_exceptions=True)
+    for answer in answers:
+        if isinstance(answer, BaseException) and not isinstance(answer, UmbrellaError):
+            raise answer
+    return dict(zip(ips, answers))
 
 # Returns a list of malicious domains associated with a given IPv4 
 # address. 
 def umbrella_ip_to_dom(ipList):
-    base_url = config.UMBRELLA["inv_url"]
-    headers = {
-        "Authorization" : "Bearer " + config.UMBRELLA["inv_token"],
-        "Content-Type" : "application/json"
-    }
-
     malicious_ips = []
+    ipList = list(ipList)
+    cache = get_ip_cache()
+    hits = cache.hits
+    answers = get_umbrella_client().run(lookup_ips_async([p['ip'] for p in ipList]))
+    cache.commit()
 
     # Error checking the API get method that retrieves malicious domains 
     # for an IPv4 address, raises issues associated with the Investigate 
     # API key.
+    failed = 0
+    # IPs to be checked again on the next run, with their first activity
+    retry = {}
     for p in ipList:
-        response = requests.get(url=base_url+"/ips/"+p['ip']+
-                                "/latest_domains",headers=headers, 
-                                verify=False)
-        if response.status_code != 200:
-            print("Error "+str(response.status_code)+" Encountered")
-            if response.status_code==403 or 401:
-                print("Please Check to Ensure The right Investigate API key is set on the env file")
-            pass
-        else:
-            data = response.json()
-            # If the array is empty no malicious domains have been found
-            if len(data) == 0:
-                print("HTTP Response: " + str(response.status_code) + 
-                    ", IP: " + str(p['ip']) + " has no domains listed as malicious by Umbrella")
-
-            # If the array is populated these are appended to a list of 
-            # dictionaries that include IP, domains and first activity
-            else:
-                malicious_domains = []
-                for m in data:
-                    malicious_domains.append(m['name'])
-                malicious_ips.append({'IP' : str(p['ip']), 'domains' : malicious_domains, 'time' : str(p['firstActivity'])})
-        
-        # Written to a file
-        with open('mal_domains.json', 'w') as f:
-            f.write(json.dumps(malicious_ips, indent=2)) 
+        malicious_domains = answers[p['ip']]
+        if isinstance(malicious_domains, UmbrellaError):
+            # Only the first error is shown, the same one is usually raised for every IP
+            if failed == 0:
+                print(str(malicious_domains))
+                if malicious_domains.status_code in (401, 403):
+                    print("Please Check to Ensure The right Investigate API key is set on the env file")
+            failed += 1
+            if malicious_domains.is_transient() and 'activity' in p:
+                record_first_seen(retry, p['ip'], p['activity'])
+            continue
+
+        # If the array is populated these are appended to a list of 
+        # dictionaries that include IP, domains and first activity
+        if len(malicious_domains) != 0:
+            malicious_ips.append({'IP' : str(p['ip']), 'domains' : malicious_domains, 'time' : str(p['firstActivity'])})
+
+    # IPs with an empty array have no domains listed as malicious
+    print(str(len(ipList)) + " IPs checked (" + str(cache.hits - hits) + " from the cache, " + str(failed)
+          + " failed), " + str(len(malicious_ips)) + " with domains listed as malicious by Umbrella")
+    if defer_public_ips(retry):
+        print(str(len(retry)) + " IPs could not be checked, they will be checked on the next run")
+
+    # Written to a file
+    with open('mal_domains.json', 'w') as f:
+        f.write(json.dumps(malicious_ips, indent=2)) 
 
     # Malicious domains returned for use in the TASK_2 main script
-    return malicious_ips
\ No newline at end of file
+    return malicious_ips
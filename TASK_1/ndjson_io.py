@@ -0,0 +1,93 @@
+"""
+Copyright (c) 2021 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+""" Writes and reads the record files used between the Task 1 scripts
+Records (python dictionaries) are written as NDJSON, one json object per line, so a new record is appended
+to the file instead of rewriting the whole list. The older format (a single json list) is still supported.
+- RecordWriter: buffered writer (truncating or appending), the file is flushed and synced to disk once, when the writer is closed.
+- read_records: generator that reads a file in any of the two formats and yields the records one by one.
+"""
+
+import json
+import os
+
+
+class RecordWriter:
+    """ Writes records to a file, either as NDJSON (one record per line) or as a single json list
+
+    Parameters
+    ----------
+    path: str
+        The file where the records are written, it is truncated when the writer is created
+    fmt: str
+        'ndjson' (default) or 'json' for the older format
+    append: bool
+        Add the records at the end of the file instead of truncating it (NDJSON only)
+    """
+
+    def __init__(self, path, fmt="ndjson", append=False):
+        self.path = path
+        self.fmt = fmt
+        self.count = 0
+        self.records = []
+        mode = "a" if append and fmt == "ndjson" else "w"
+        self.file = open(path, mode, encoding="utf-8", buffering=1024 * 1024)
+
+    def write(self, record):
+        if self.fmt == "json":
+            self.records.append(record)
+        else:
+            self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.count += 1
+
+    def close(self):
+        if self.file.closed:
+            return
+        if self.fmt == "json":
+            self.file.write(json.dumps(self.records, indent=2))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_records(path):
+    """ Yields the records stored in a file, one at a time
+
+    Parameters
+    ----------
+    path: str
+        File written as NDJSON or as a single json list
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        first = f.read(1)
+        while first.isspace():
+            first = f.read(1)
+        f.seek(0)
+
+        # Older format, the whole list has to be parsed at once
+        if first == "[":
+            for record in json.load(f):
+                yield record
+            return
+
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
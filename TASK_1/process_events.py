@@ -17,121 +17,207 @@ or implied.
 '''
 This script pushes only the relevant information to CV Center
 
-Furthermore, this script is divided into 3 functions:
-- Funcion 1 (check_domain()):
-    DESCRIPTION: given a domain and the domains database, it returns whether it has been previously queried or not
-    INPUTS (2): domain to query, domains database
-    OUTPUTS (1): returns a 1 if it is the 1st time seen, a 0 otherwise
+Furthermore, this script is divided into 5 functions:
+- Funcion 1 (push_decisions()):
+    DESCRIPTION: decides, for all the DNS queries at once, which ones are pushed into CV: those of domains that have never
+        been pushed, or that were last pushed more than time_between_queries days before the query (see env.py)
+    INPUTS (2): list of malicious domains, domains database
+    OUTPUTS (1): list of (push, epoch of the query, epoch of the last push), one for each DNS query
 
 - Function 2 (process_events()):
-    DESCRIPTION: first, it determines if it is the 1st time that the malicious domain has been queried. If it is the case,
-        it gets the information from Umbrella and uploads it into CV. If not, it will not do anything (this is subject to 
-        change in future versions)
+    DESCRIPTION: first, it determines if the malicious domain has to be pushed (see push_decisions()), and, if
+        REPUTATION_ENGINE is enabled, checks all those domains against the reputation providers at once. A domain whose
+        merged verdict is clean is not pushed. If it has to be pushed, it gets the information from Umbrella, queues it
+        to be uploaded into CV (the queries of a domain together, see push_events.py) and records the push in the
+        domains DB. If not, it will not do anything
     INPUTS (1): list of malicious domains, domains DB
-    OUTPUTS (0): push/not push the domain
+    OUTPUTS (1): push/not push the domain, returns the list of DNS queries not pushed because Umbrella or CV could not
+        be reached
 
 - Function 3 (filter_malicious()):
     DESCRIPTION: given a list of  domains, it determines which domains are malicious/unknown (and therefore sohuld be pushed
-        into CV), and which ones are not (and are ignored)
+        into CV), and which ones are not (and are ignored). Each different domain is categorized only once (in bulk, one
+        Umbrella request for each chunk of domains), and its verdict applies to all the queries of that domain. The Risk
+        Score is not requested here, only in process_events() for the domains that are actually pushed. The domains in
+        the allowlist (see allowlist.py) are skipped before any request. If DOMAIN_NORMALIZATION is enabled in the env
+        file, the subdomains of a site share the verdict of their registrable domain (see public_suffix.py). The queries
+        of the domains that could not be checked because Umbrella could not be reached are deferred to the next run
+        (see deferred.py), the other domains that could not be checked are skipped
     INPUTS (1): list of domains to be checked
     OUTPUTS (1): list of domains that need to be sent to CV
+
+- Function 4 (group_sightings()):
+    DESCRIPTION: groups a list of DNS queries by domain
+    INPUTS (1): list of domains
+    OUTPUTS (1): dictionary with the list of (IP, time) queries of each domain, with the time they were first deferred
+        for the queries left by a previous run
+
+- Function 5 (get_event_reputation()):
+    DESCRIPTION: gets the reputation of a domain that is going to be pushed into CV, only once per run. If REPUTATION_ENGINE
+        is enabled in the env file, the merged verdict of all the reputation providers (see reputation_engine.py) is added
+    INPUTS (3): domain, dictionary of the reputations already requested, merged verdicts of the reputation providers
+    OUTPUTS (1): "query" dictionary (the last one kept in the cache if Umbrella cannot be reached), None if there is none.
+        Raises UmbrellaError if Umbrella answered but could not check the domain
 '''
 
 import requests
 import json
-import datetime
+import itertools
+import collections
 
 # Import the functions from other scripts
-from create_event import CV_event
-from get_reputation import get_reputation
-from push_events import push_events
-from get_domain_and_push_it import get_position
+from create_event import CV_findings_event
+from get_reputation import get_reputation, get_categorization_bulk, get_stale_reputation
+from umbrella_client import UmbrellaError
+from reputation_engine import check_domains, settings as engine_settings
+from allowlist import get_allowlist
+from public_suffix import lookup_name
+from deferred import defer_sightings, take_deferred
+from push_events import new_event_dispatcher, settings as push_settings
+from domains_store import get_domains_store, to_epoch
+from env import time_between_queries
+
 
-file = open('domains_DB.json',)
-domains_DB = json.load(file)
+# Last push of the domains that have never been pushed, every query is more than time_between_queries after it
+NEVER = -2 ** 62
 
 
 ## FUNCTION
-# Checks whether the domain has been previously checked
-# domains_DB is the list of domains (in a database) that have already been queried
-def check_domain(domain, domains_DB):
+# Decides at once which DNS queries are pushed into CV: those of a domain never pushed, or last pushed more than
+# time_between_queries days before the query. Only integers are compared, the last push of each domain comes from the
+# index in the domains DB (see domains_store.py). Returns a (push, epoch of the query, epoch of the last push) tuple
+# for each query, in the same order
+def push_decisions(malicious_list, domains_DB):
+    threshold = time_between_queries * 24 * 60 * 60
+    epochs = [to_epoch(item["time"]) for item in malicious_list]
+    pushed = domains_DB.last_pushed({item["domain"] for item in malicious_list})
+    last_pushes = [pushed.get(item["domain"], NEVER) for item in malicious_list]
+    return [(epoch - last_push > threshold, epoch, last_push) for epoch, last_push in zip(epochs, last_pushes)]
 
-    # Assume that it is the first time queried, set the variable to 1 (YES)
-    first_time = 1
-    for item in domains_DB:
-        if item["domain"] == domain:
-            # If the DNS has been queried previously, set the variable to 0 (NO)
-            first_time = 0
 
-    return first_time
+## FUNCTION
+# Gets the reputation of a domain that is going to be pushed into CV. reputations keeps the ones already requested,
+# so a domain is only checked once per run. merged has the merged verdicts of the reputation providers, checked by
+# process_events() for all the domains at once. Returns None if Umbrella could not be reached, raises UmbrellaError if
+# Umbrella answered but could not check the domain
+def get_event_reputation(domain, reputations, merged=None):
+    # The reputation may be the one of the registrable domain, the event keeps the full domain
+    name = lookup_name(domain)
+    if name not in reputations:
+        try:
+            reputations[name] = dict(get_reputation(name))
+        except UmbrellaError as e:
+            # Use the last reputation kept in the cache, if there is one
+            reputations[name] = get_stale_reputation(name)
+            if reputations[name] is None:
+                del reputations[name]
+                if not e.is_transient():
+                    raise
+                print("Domain " + domain + " not pushed, Umbrella could not be reached: " + str(e) + "\n")
+                return None
+
+        # Add the merged verdict of all the reputation providers
+        if merged and name in merged:
+            reputations[name].update(merged[name])
+
+    reputation = dict(reputations[name])
+    reputation["domain"] = domain
+    return reputation
 
 
 # FUNCTION
 # Given a DNS domain and its associated IP, make the decision of whether to push it or not
 # into CV Center, based on previous Events
-def process_events(malicious_list, domains_DB):
-    for item in malicious_list:
-
-        first_time_appeared = check_domain(item["domain"], domains_DB["list"])
+def process_events(malicious_list, domains_DB=None):
+    # The shared domains DB is opened on first use, not when the script is imported
+    if domains_DB is None:
+        domains_DB = get_domains_store()
+    # Reputation of each domain, only requested once even if the domain has been queried many times
+    reputations = {}
+    # DNS queries not pushed because Umbrella or CV could not be reached
+    deferred = []
+    days = str(float(time_between_queries))
+
+    # The decision is taken for all the DNS queries at once, before pushing any of them
+    decisions = push_decisions(malicious_list, domains_DB)
+
+    # The events are pushed by worker threads while the next domains are checked. The queries of a domain to be pushed
+    # are kept until the last one is checked, and pushed together (up to 'max_findings' in an event, see EVENT_PUSH)
+    dispatcher = new_event_dispatcher()
+    max_findings = int(push_settings.get("max_findings", 20)) if push_settings.get("coalesce", True) else 1
+    remaining = collections.Counter(item["domain"] for item, (push, _, _) in zip(malicious_list, decisions) if push)
+    findings = {}
+
+    # Merged verdict of all the reputation providers (see reputation_engine.py), for all the domains to be pushed at once
+    merged = {}
+    if engine_settings.get("enabled"):
+        names = {lookup_name(item["domain"]) for item, (push, _, _) in zip(malicious_list, decisions) if push}
+        if names:
+            merged = check_domains(sorted(names))
+
+    for item, (push, epoch, last_push) in zip(malicious_list, decisions):
         print("Checking domain " + item["domain"] + " ...")
-        
-        if first_time_appeared == 1:
-            print("Domain " + item["domain"] + " has never appeared. Domain pushed to Cyber Vision\n")
-            # Get reputation from Umbrella
-            reputation = get_reputation(item["domain"])
-
-            # Create message to upload to CV
-            reputation["IP"] = item["IP"]
-            reputation["Date"] = item["time"]
-            payload = CV_event(reputation)
-
-            # Push event into CV
-            push_events(payload)
 
-        elif first_time_appeared == 0:
-            # print(item["domain"] + " already appeared!!\n")
+        if not push:
+            print("Domain " + item["domain"] + " already appeared. Domain not pushed to Cyber Vision as less than " + days + " days have passed.\n")
+            continue
 
-            # Get index position of domain
-            index = get_position(item["domain"], domains_DB)
-
-            # Get timestamp for current event
-            current_time = datetime.datetime.strptime(item["time"], "%Y-%m-%d %H:%M:%S")
-            current_time = datetime.datetime.timestamp(current_time)
-
-            # Get timestamp for last event
-            size = len(domains_DB["list"][index]["queries"]) - 1
-            last_time = datetime.datetime.strptime(domains_DB["list"][index]["queries"][size]["time"], "%Y-%m-%d %H:%M:%S")
-            last_time = datetime.datetime.timestamp(last_time)
-
-            # Time difference in timestamp
-            delta_time = current_time - last_time
-
-            # Get time_between_queries from the configuration file and convert to seconds
-            from env import time_between_queries
-            time_between_queries = time_between_queries * 24 * 60 * 60
-
-            # Set condition for posting the event in CV
-            if delta_time > time_between_queries:
-                # We need to post the event into CV
-                time_between_queries = str(time_between_queries / 24 / 60 / 60)
-                print("Domain " + item["domain"] + " already appeared. Domain pushed to Cyber Vision as more than " + time_between_queries + " days have passed.\n")
-                # Get reputation from Umbrella
-                reputation = get_reputation(item["domain"])
+        # The reputation providers together say the domain is clean
+        verdict = merged.get(lookup_name(item["domain"]))
+        if verdict is not None and verdict["merged_status"] == 1:
+            print("Domain " + item["domain"] + " not pushed to Cyber Vision, its combined score of " + str(verdict["merged_score"]) + "/100 is clean.\n")
+            remaining[item["domain"]] -= 1
+            continue
 
+        if last_push == NEVER:
+            print("Domain " + item["domain"] + " has never appeared. Domain pushed to Cyber Vision\n")
+        else:
+            print("Domain " + item["domain"] + " already appeared. Domain pushed to Cyber Vision as more than " + days + " days have passed.\n")
+
+        # Get reputation from Umbrella
+        remaining[item["domain"]] -= 1
+        try:
+            reputation = get_event_reputation(item["domain"], reputations, merged)
+        except UmbrellaError as e:
+            # Checking it again on the next run would get the same answer, the DNS query is dropped
+            print("Domain " + item["domain"] + " not pushed, Umbrella could not check it: " + str(e) + "\n")
+        else:
+            if reputation is None:
+                deferred.append(item)
+            else:
                 reputation["IP"] = item["IP"]
                 reputation["Date"] = item["time"]
+                findings.setdefault(item["domain"], []).append((item, epoch, reputation))
+
+        if remaining[item["domain"]] == 0 and item["domain"] in findings:
+            domain_findings = findings.pop(item["domain"])
+            for i in range(0, len(domain_findings), max_findings):
+                chunk = domain_findings[i:i + max_findings]
+                # Create message to upload to CV, and queue it to be pushed
+                dispatcher.submit(CV_findings_event([reputation for _, _, reputation in chunk]), chunk)
+
+    pushed, failed = dispatcher.close()
+    for chunk in pushed:
+        for item, epoch, _ in chunk:
+            # Saved with the DNS queries of the run (see integration_process())
+            domains_DB.mark_pushed(item["domain"], epoch)
+    for chunk in failed:
+        deferred.extend(item for item, _, _ in chunk)
+    dispatcher.print_summary()
+
+    return deferred
 
-                # Create message to upload to CV
-                payload = CV_event(reputation)
-
-                # Push event into CV
-                push_events(payload)
-            else:
-                time_between_queries = str(time_between_queries / 24 / 60 / 60)
-                print("Domain " + item["domain"] + " already appeared. Domain not pushed to Cyber Vision as less than " + time_between_queries + " days have passed.\n")
-
-        else:
-            print("The code is not functioning properly. Please check!")
+## FUNCTION
+# Groups the DNS queries by domain, each domain keeps the list of (IP, time) in which it has been queried
+def group_sightings(domains_list):
+    sightings = {}
+    for item in domains_list:
+        query = {"IP" : item["IP"], "time" : item["time"]}
+        # Queries taken back from the deferred file keep the time they were first deferred (see deferred.py)
+        if "deferred_at" in item:
+            query["deferred_at"] = item["deferred_at"]
+        sightings.setdefault(item["domain"], []).append(query)
+    return sightings
 
 ## FUNCTION
 # Gets the list of DNS queries, and outputs only the malicious/unknown ones
@@ -140,16 +226,40 @@ def filter_malicious(domains_list):
 
     print("Filtering domains...")
     
-    i = 0
-    for item in domains_list:
-        umbrella_response = get_reputation(item["domain"])
-
-        if umbrella_response["url_status"] == -1: # The domain is malicious
-            malicious_list.append(domains_list[i])
-        elif umbrella_response["url_status"] == 0: # The domain is unknown
-            malicious_list.append(domains_list[i])
-        
-        i = i + 1
-        
-
-    return malicious_list
\ No newline at end of file
+    # domains_list can be a generator (see get_DNS_queries.py), it is only iterated once.
+    # A domain queried by many hosts is only checked once. The queries that the previous run could not check are added
+    sightings = group_sightings(itertools.chain(take_deferred(), domains_list))
+
+    # Well-known domains are not checked at all
+    domains = list(sightings)
+    allowlist = get_allowlist()
+    if allowlist is not None:
+        domains = allowlist.filter(domains)
+        allowlist.print_stats()
+
+    # One verdict for each different domain (or registrable domain, see public_suffix.py), categorized with bulk
+    # Umbrella requests
+    unavailable = set()
+    umbrella_responses = get_categorization_bulk([lookup_name(domain) for domain in domains], unavailable)
+
+    # Domains that Umbrella could not check because it could not be reached are kept for the next run. The others
+    # (e.g. no categorization returned) would fail again, they are dropped
+    unchecked = [domain for domain in domains if lookup_name(domain) not in umbrella_responses]
+    defer_sightings([dict(query, domain=domain)
+                     for domain in unchecked if lookup_name(domain) in unavailable for query in sightings[domain]])
+    dropped = [domain for domain in unchecked if lookup_name(domain) not in unavailable]
+    if dropped:
+        print(str(len(dropped)) + " domains could not be categorized by Umbrella and are skipped")
+
+    for domain, queries in sightings.items():
+        # Domains that are allowed or that Umbrella could not check are left out
+        umbrella_response = umbrella_responses.get(lookup_name(domain))
+        if umbrella_response is None:
+            continue
+
+        if umbrella_response["url_status"] in [-1, 0]: # The domain is malicious or unknown
+            # Give the verdict back to every query of the domain
+            for query in queries:
+                malicious_list.append(dict(query, domain=domain))
+
+    return malicious_list
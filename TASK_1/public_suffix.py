@@ -0,0 +1,150 @@
+"""
+Copyright (c) 2021 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+"""
+Maps a domain to its registrable domain (eTLD+1), e.g.
+"cdn3.images.example.co.uk" to "example.co.uk".
+The rules come from a copy of the Public Suffix List bundled with the
+scripts (public_suffix_list.dat), plus the hosting suffixes missing from
+it (public_suffix_extra.dat). They are compiled once into a trie of
+reversed labels ("uk" -> "co" -> ...), so finding the public suffix of a
+domain takes one dictionary lookup per label. Wildcard ("*.ck") and
+exception ("!www.ck") rules are supported. Unlike the reference
+algorithm, a domain whose suffix is not in the rules is not normalized,
+so that unrelated sites never share a verdict.
+- registrable_domain: returns the eTLD+1 of a domain.
+- lookup_name: returns the name used to check and cache the reputation
+    of a domain, its eTLD+1 if the normalization is enabled in the env
+    file (DOMAIN_NORMALIZATION), the domain itself otherwise.
+"""
+
+import os
+import threading
+from functools import lru_cache
+
+import env
+
+settings = getattr(env, "DOMAIN_NORMALIZATION", {})
+
+# Keys of a trie node that are not labels
+_RULE = "$"
+_EXCEPTION = "!"
+
+_trie = None
+_lock = threading.Lock()
+
+
+def compile_rules(path, trie=None):
+    """
+    Reads a public suffix list file and returns its rules as a trie of
+    nested dictionaries, keyed by label from the TLD down. A node has
+    the _RULE key if its suffix is a rule, and the _EXCEPTION key with
+    the set of labels excepted from a wildcard rule. The rules are added
+    to trie if one is given.
+    """
+    if trie is None:
+        trie = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            # Rules end at the first whitespace, comments start with //
+            rule = line.strip().split(" ")[0].lower()
+            if not rule or rule.startswith("//"):
+                continue
+            exception = rule.startswith("!")
+            labels = rule.lstrip("!").split(".")
+
+            node = trie
+            if exception:
+                # "!www.ck": www is excepted from the "*.ck" rule
+                for label in reversed(labels[1:]):
+                    node = node.setdefault(label, {})
+                node.setdefault(_EXCEPTION, set()).add(labels[0])
+            else:
+                for label in reversed(labels):
+                    node = node.setdefault(label, {})
+                node[_RULE] = True
+    return trie
+
+
+def get_rules():
+    """
+    Returns the compiled rules, reading the files on first use.
+    """
+    global _trie
+    with _lock:
+        if _trie is None:
+            folder = os.path.dirname(os.path.abspath(__file__))
+            trie = compile_rules(settings.get("suffix_file") or os.path.join(folder, "public_suffix_list.dat"))
+            extra = settings.get("extra_suffix_file", os.path.join(folder, "public_suffix_extra.dat"))
+            if extra:
+                compile_rules(extra, trie)
+            _trie = trie
+        return _trie
+
+
+def public_suffix_length(labels, trie):
+    """
+    Number of labels, from the right, that make the public suffix of a
+    domain split into labels, 0 if no rule matches it.
+    """
+    length = 0
+    node = trie
+    depth = 0
+    for label in reversed(labels):
+        if label in node.get(_EXCEPTION, ()):
+            # The suffix is the parent of the excepted name
+            return depth
+        child = node.get(label)
+        if child is None:
+            child = node.get("*")
+        if child is None:
+            break
+        depth += 1
+        if _RULE in child:
+            length = depth
+        node = child
+    return length
+
+
+@lru_cache(maxsize=100000)
+def registrable_domain(domain):
+    """
+    Returns the registrable domain (eTLD+1) of a domain, lowercase. A
+    domain that is itself a public suffix, whose suffix is not in the
+    rules, a single label or an IP address is returned as it is.
+    """
+    name = domain.strip().rstrip(".").lower()
+    labels = name.split(".")
+    if len(labels) < 2 or "" in labels or labels[-1].isdigit() or ":" in name:
+        return name
+
+    length = public_suffix_length(labels, get_rules())
+    # Falling back to the last label would give unrelated sites the same name
+    if length == 0 or length >= len(labels):
+        return name
+    return ".".join(labels[-(length + 1):])
+
+
+def lookup_name(domain):
+    """
+    Name under which the reputation of a domain is checked and cached:
+    its registrable domain if "registrable_domain" is enabled in
+    DOMAIN_NORMALIZATION, the domain itself otherwise.
+    """
+    if settings.get("registrable_domain", False):
+        return registrable_domain(domain)
+    return domain
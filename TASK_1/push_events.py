@@ -18,24 +18,156 @@ or implied.
 This script gets a payload/report as an input, and uploads it into the CV Center**
 ** Please note that in order to work, this script should be run locally in the CV Center
 
-This script is divided into 1 function:
+This script is divided into 2 functions and 1 class:
 - Funcion 1 (push_events()):
     DESCRIPTION: given a report (the message that want to be posted), print the event into the CV Center
     INPUTS (1): report/message/data structure
     OUTPUTS (0): prints the event into CV, and prints the status code from the API request
+
+- Function 2 (never_sent()):
+    DESCRIPTION: tells whether a request failed before reaching the server (connection refused, connect timeout...)
+    INPUTS (1): exception raised by requests
+    OUTPUTS (1): True if sending the request again cannot duplicate it
+
+- Class 1 (EventDispatcher):
+    DESCRIPTION: queue of reports pushed into the CV Center by worker threads, over the connections shared by all the
+        scripts (see api_client.py). The shared client already retries a report answered with 429. A report that
+        could not be sent at all (CV could not be connected to) is sent again, up to 'max_retries' times. A report
+        that may have reached CV (timeout while waiting for the answer, 5xx) is not sent again, so that the event is
+        not shown twice. At the end of the run it tells which reports were pushed and which ones failed, and
+        prints how many there were and how long the pushes took (EVENT_PUSH in env.py)
+    INPUTS (1): reports submitted with submit(), each one with a key given back in the results
+    OUTPUTS (2): keys of the reports pushed, keys of the reports that failed
 '''
 
-import requests
 import json
+import queue
+import threading
+import time
+
+import requests
+import urllib3
+
+import env
 from env import *
+from api_client import get_cybervision_client
 
 base_url = CYBERVISION.get("base_url")
+settings = getattr(env, "EVENT_PUSH", {})
 
 ## FUNCTION
 # Pushes event into the Cyber Vision Center
 def push_events(report):
     url = base_url+"extension/test/report" 
     
-    response = requests.post(url, json=report)
+    response = get_cybervision_client().post(url, json=report)
 
     print(response.status_code)
+
+## FUNCTION
+# Tells whether a request failed before reaching the server, so that sending it again cannot duplicate it
+def never_sent(error):
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(error, requests.exceptions.ConnectionError) and isinstance(reason, urllib3.exceptions.NewConnectionError)
+
+
+class EventDispatcher:
+    """ Pushes reports into CV from worker threads
+
+    Parameters
+    ----------
+    workers: int
+        Number of reports pushed at the same time
+    max_retries: int
+        Number of times a report that could not be sent is sent again
+    backoff_factor: float
+        Seconds to wait before sending a report again, doubled for every following retry
+    """
+
+    def __init__(self, workers=4, max_retries=3, backoff_factor=1):
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.pushed = []
+        self.failed = []
+        self.retries = 0
+        self.latencies = []
+        self.threads = [threading.Thread(target=self.work, daemon=True) for _ in range(max(1, int(workers)))]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, report, key=None):
+        """ Queues a report, key is given back by close() to tell whether it was pushed
+        """
+        self.queue.put((report, key))
+
+    def send(self, report):
+        """ Posts a report, sending it again while CV cannot be connected to. The other errors are retried by the
+        client (429) or not at all, as the report may have reached CV. Returns None if it was pushed, the error
+        otherwise
+        """
+        url = base_url + "extension/test/report"
+        attempt = 0
+        while True:
+            try:
+                response = get_cybervision_client().post(url, json=report)
+                if response.status_code < 300:
+                    return None
+                return "status code " + str(response.status_code)
+            except requests.exceptions.RequestException as e:
+                # Only a report that never reached CV can be sent again without showing the event twice
+                if not never_sent(e) or attempt >= self.max_retries:
+                    return str(e)
+
+            with self.lock:
+                self.retries += 1
+            time.sleep(self.backoff_factor * (2 ** attempt))
+            attempt += 1
+
+    def work(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            report, key = job
+            start = time.monotonic()
+            try:
+                error = self.send(report)
+            except Exception as e:
+                # Whatever happens, the report is given back as failed and the worker goes on with the next one
+                error = "unexpected error: " + repr(e)
+            with self.lock:
+                self.latencies.append(time.monotonic() - start)
+                if error is None:
+                    self.pushed.append(key)
+                else:
+                    self.failed.append(key)
+                    print("Event not pushed to Cyber Vision: " + error)
+
+    def close(self):
+        """ Waits until every report queued is pushed or has failed, and stops the workers. Returns the keys of the
+        reports pushed and the keys of the ones that failed
+        """
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        return self.pushed, self.failed
+
+    def print_summary(self):
+        if not self.latencies:
+            return
+        latencies = sorted(self.latencies)
+        print("Events: " + str(len(self.pushed)) + " pushed to Cyber Vision, " + str(len(self.failed)) + " failed, "
+              + str(self.retries) + " retries. Push latency: " + str(round(1000 * sum(latencies) / len(latencies)))
+              + " ms on average, " + str(round(1000 * latencies[-1])) + " ms at most")
+
+
+def new_event_dispatcher():
+    """ Returns a new dispatcher for the reports of a run, as configured in env.py (EVENT_PUSH)
+    """
+    return EventDispatcher(settings.get("workers", 4), settings.get("max_retries", 3),
+                           settings.get("backoff_factor", 1))
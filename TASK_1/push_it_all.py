@@ -22,7 +22,8 @@ by pushing the malicious ones into the CV Center.
 Furthermore, this script is divided into 1 function:
 - Funcion 1 (push_it_all()):
     DESCRIPTION: first, get the malicious domains from the original list of domains. For those domains that are malicious,
-        the script processes the events (check process_events.py for more information), and then adds them to the domains DB
+        the script processes the events (check process_events.py for more information), and then adds them to the domains DB.
+        The DNS queries left by the previous run (see deferred.py) are only removed once all of this has finished
     INPUTS (2): list of domains, domains SB
     OUTPUTS (0): pushes all malicious domains into CV
 '''
@@ -34,27 +35,45 @@ import json
 from process_events import process_events
 from get_domain_and_push_it import integration_process
 from process_events import filter_malicious
-
-file = open('domains_DB.json',)
-domains_DB = json.load(file)
+from reputation_cache import print_stats, commit as commit_reputation_cache
+from deferred import defer_sightings, commit_deferred
+from domains_store import get_domains_store
 
 ## FUNCTION
 # Gets the list of domains, processes them, and upload them into CV
-def push_it_all(domains_list, domains_DB):
+def push_it_all(domains_list, domains_DB=None):
+    # The shared domains DB is opened on first use, not when the script is imported
+    if domains_DB is None:
+        domains_DB = get_domains_store()
+
+    try:
+        # Filter those domains that are not malicious
+        malicious_list = filter_malicious(domains_list)
+
+        # Check only if there are malicious/unknown DNS queries
+        if not malicious_list:
+            print("Nothing to process")
+        else:
+            # Processes the events depending on whether they have already been queried or not
+            deferred = process_events(malicious_list, domains_DB)
+
+            # The DNS queries that could not be pushed are not added to the DB, they are processed again on the next run
+            if deferred:
+                defer_sightings(deferred)
+                deferred = {id(item) for item in deferred}
+                malicious_list = [item for item in malicious_list if id(item) not in deferred]
 
-    # Filter those domains that are not malicious
-    malicious_list = filter_malicious(domains_list)
+            # Check list of domains with Umbrella, adds them to the DB
+            integration_process(malicious_list, domains_DB)
 
-    # Check only if there are malicious/unknown DNS queries
-    if not malicious_list:
-        print("Nothing to process")
-    else:
-        # Processes the events depending on whether they have already been queried or not
-        process_events(malicious_list, domains_DB)
+        # The DNS queries left by the previous run have been processed or deferred again
+        commit_deferred()
+    finally:
+        # The Umbrella answers are kept even if the run stops on an error
+        commit_reputation_cache()
 
-        # Check list of domains with Umbrella, adds them to the DB
-        integration_process(malicious_list, domains_DB)
-    
+    # Show how many Umbrella requests have been avoided
+    print_stats()
 
 
 # Example to test code
@@ -64,5 +83,5 @@ example = [{"domain" : "google.com", "IP" : "1.1.1.1", "time" : "2021-04-22 16:0
            {"domain" : "cisco.com", "IP" : "3.3.3.3", "time" : "2021-04-22 16:00:00"},
            {"domain" : "example.com", "IP" : "2.76.3.2", "time" : "2021-04-22 16:00:00"},
            {"domain" : "internetbadguys.com", "IP" : "24.54.87.71", "time" : "2021-07-22 17:00:00"}]
-push_it_all(example, domains_DB)
+push_it_all(example)
 '''
\ No newline at end of file
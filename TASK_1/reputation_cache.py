@@ -0,0 +1,135 @@
+"""
+Copyright (c) 2021 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+# KEEPS THE UMBRELLA REPUTATION OF EACH DOMAIN FOR SOME TIME
+
+'''
+The same domain used to be checked against Umbrella several times in a single run (when filtering the malicious domains,
+when processing the events...). This script keeps the Umbrella answers in a cache (see ttl_cache.py) that every call in
+get_reputation.py goes through. How long an answer is kept depends on its verdict, and is set in the env file
+(REPUTATION_CACHE): clean domains rarely change, malicious and unknown ones are checked again sooner.
+
+Furthermore, this script is divided into 5 functions:
+- Funcion 1 (get_reputation_cache()):
+    DESCRIPTION: returns the cache shared by all the scripts, opened on first use
+    INPUTS (0)
+    OUTPUTS (1): the cache
+
+- Function 2 (get_ttl()):
+    DESCRIPTION: given the "query" dictionary of a domain, returns how long it can be kept, depending on its status
+    INPUTS (1): "query" dictionary
+    OUTPUTS (1): time to live, in seconds
+
+- Function 3 (print_stats()):
+    DESCRIPTION: prints the hit rate of the cache and the number of Umbrella API calls it has saved
+    INPUTS (0)
+    OUTPUTS (0): prints a message
+
+- Function 4 (coalesce()):
+    DESCRIPTION: runs a lookup for a key, unless the same lookup is already running in another thread. In that case it
+        waits for it and returns its result, so a domain checked by several threads at once is only requested once
+    INPUTS (2): key (e.g. the domain), function making the lookup
+    OUTPUTS (1): result of the lookup
+
+- Function 5 (commit()):
+    DESCRIPTION: saves the answers added to the cache to disk, if the cache has been opened
+    INPUTS (0)
+    OUTPUTS (0)
+'''
+
+import threading
+from concurrent.futures import Future
+import env
+from ttl_cache import TTLCache
+
+settings = getattr(env, "REPUTATION_CACHE", {})
+
+# Time to live (in hours) of each verdict: 1 = clean, -1 = malicious, 0 = unknown
+TTL_HOURS = {
+    1: settings.get("ttl_clean_hours", 168),
+    -1: settings.get("ttl_malicious_hours", 24),
+    0: settings.get("ttl_unknown_hours", 6)
+}
+
+# Number of Umbrella API calls that have been made, and avoided thanks to the cache
+stats = {"api_calls": 0, "saved_calls": 0}
+
+_reputation_cache = None
+_lock = threading.Lock()
+
+# Lookups currently running, by key
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+## FUNCTION
+# Returns the cache shared by all the scripts
+def get_reputation_cache():
+    global _reputation_cache
+    with _lock:
+        if _reputation_cache is None:
+            _reputation_cache = TTLCache(settings.get("file", "reputation_cache.sqlite"), "reputation",
+                                         int(settings.get("memory_entries", 10000)))
+        return _reputation_cache
+
+
+## FUNCTION
+# Time to live (in seconds) of an Umbrella answer, depending on its status
+def get_ttl(query):
+    return TTL_HOURS.get(query.get("url_status"), TTL_HOURS[0]) * 3600
+
+
+## FUNCTION
+# Prints the statistics of the cache
+def print_stats():
+    cache = get_reputation_cache()
+    print("Reputation cache: " + str(cache.hits) + " hits, " + str(cache.misses) + " misses ("
+          + str(round(cache.hit_rate(), 1)) + "% hit rate), " + str(stats["api_calls"]) + " Umbrella API calls made, "
+          + str(stats["saved_calls"]) + " saved")
+
+
+## FUNCTION
+# Runs fetch() once for all the threads asking for the same key at the same time
+def coalesce(key, fetch):
+    with _inflight_lock:
+        future = _inflight.get(key)
+        owner = future is None
+        if owner:
+            future = Future()
+            _inflight[key] = future
+
+    # Another thread is already making this lookup
+    if not owner:
+        stats["saved_calls"] += 1
+        return future.result()
+
+    try:
+        result = fetch()
+        future.set_result(result)
+        return result
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            del _inflight[key]
+
+
+## FUNCTION
+# Saves the answers of the run to disk, so the Umbrella calls already made are not lost if the run stops later
+def commit():
+    with _lock:
+        cache = _reputation_cache
+    if cache is not None:
+        cache.commit()
@@ -0,0 +1,275 @@
+"""
+Copyright (c) 2021 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+""" Checks a domain against several reputation providers at the same time
+The providers (Umbrella Investigate, WhoisXMLAPI Domain Reputation and IPQUALITYSCORE, see 3rdpartychecks.py) are asked
+in parallel. Each answer is converted into a verdict with a score from 0 (clean) to 100 (malicious) and a confidence, and
+the verdicts are merged into a single score, weighted by the confidence and the weight of each provider.
+- every provider has its own timeout and its own quota (requests per second and per day), a provider that is too slow
+  or out of quota is left out of the merged score
+- every provider has its own circuit breaker (see circuit_breaker.py), a provider that keeps failing is not asked for
+  a while
+- if a provider says the domain is malicious with a high confidence, the other lookups are cancelled (short-circuit)
+Everything is configured in REPUTATION_ENGINE in env.py.
+"""
+
+import asyncio
+import atexit
+import importlib
+import threading
+from abc import ABC, abstractmethod
+
+import env
+from get_reputation import get_categorization_bulk_async
+from umbrella_client import TokenBucket, QuotaExceeded
+from circuit_breaker import get_breaker
+
+# 3rdpartychecks.py cannot be imported with a normal import statement, its name starts with a digit
+thirdparty = importlib.import_module("3rdpartychecks")
+
+settings = getattr(env, "REPUTATION_ENGINE", {})
+
+
+class Provider(ABC):
+    """ A reputation provider, with its own timeout and quota
+
+    Parameters
+    ----------
+    name: str
+        Name of the provider, as in REPUTATION_ENGINE in env.py
+    weight: float
+        Weight of its verdicts in the merged score
+    timeout: float
+        Seconds to wait for an answer before leaving the provider out
+    per_second, per_day: int
+        Quota of the provider (see umbrella_client.TokenBucket), 0 requests per second for no limit
+    """
+
+    def __init__(self, name, weight=1.0, timeout=10, per_second=0, per_day=0):
+        self.name = name
+        self.weight = float(weight)
+        self.timeout = timeout
+        self.bucket = TokenBucket(per_second, per_day, name + "_quota.json") if per_second or per_day else None
+        self.breaker = get_breaker(name)
+
+    @abstractmethod
+    async def lookup(self, domain):
+        """ Returns the answer of the provider for the domain
+        """
+
+    @abstractmethod
+    def normalize(self, answer):
+        """ Converts the answer of the provider into (score, confidence)
+        """
+
+    async def verdict(self, domain):
+        """ Asks the provider and returns its verdict, or None if it has no answer in time, is out of quota or its
+        circuit breaker is open
+        """
+        if not self.breaker.allow():
+            return None
+        try:
+            if self.bucket is not None:
+                await self.bucket.acquire()
+            answer = await asyncio.wait_for(self.lookup(domain), self.timeout)
+            score, confidence = self.normalize(answer)
+        except QuotaExceeded as e:
+            self.breaker.release()
+            print(self.name + ": " + str(e))
+            return None
+        except asyncio.CancelledError:
+            # Cancelled by a short-circuit, the provider did not fail
+            self.breaker.release()
+            raise
+        except asyncio.TimeoutError:
+            self.breaker.record_failure()
+            print(self.name + ": no answer for " + domain + " after " + str(self.timeout) + " seconds")
+            return None
+        except Exception as e:
+            self.breaker.record_failure()
+            print(self.name + ": could not check " + domain + ": " + str(e))
+            return None
+        self.breaker.record_success()
+        return {"provider": self.name, "score": score, "confidence": confidence}
+
+    async def run_blocking(self, function, domain):
+        """ Runs a lookup of 3rdpartychecks.py in a thread, so it does not block the other providers
+        """
+        def call():
+            try:
+                return function(domain, timeout=self.timeout)
+            except SystemExit as e:
+                # make_secure_api_call() raises SystemExit when the request fails, that would stop the event loop
+                raise RuntimeError(str(e))
+        return await asyncio.get_running_loop().run_in_executor(None, call)
+
+    def close(self):
+        if self.bucket is not None:
+            self.bucket.save_quota()
+
+
+class UmbrellaProvider(Provider):
+    """ Umbrella Investigate categorization, through the reputation cache (see get_reputation.py)
+    """
+
+    async def lookup(self, domain):
+        categorizations = await get_categorization_bulk_async([domain])
+        return categorizations[domain]
+
+    def normalize(self, answer):
+        if answer["url_status"] == -1:
+            return 100, 0.9
+        if answer["url_status"] == 1:
+            return 0, 0.8
+        return 50, 0.2
+
+
+class WhoisXMLProvider(Provider):
+    """ WhoisXMLAPI Domain Reputation, reputationScore goes from 0 (dangerous) to 100 (safe)
+    """
+
+    async def lookup(self, domain):
+        return await self.run_blocking(thirdparty.whoisxml_domain_reputation, domain)
+
+    def normalize(self, answer):
+        return 100 - float(answer["reputationScore"]), 0.6
+
+
+class IPQualityScoreProvider(Provider):
+    """ IPQUALITYSCORE URL check, risk_score goes from 0 (clean) to 100 (malicious)
+    """
+
+    async def lookup(self, domain):
+        return await self.run_blocking(thirdparty.ip_quality_score, domain)
+
+    def normalize(self, answer):
+        score = float(answer["risk_score"])
+        if answer.get("malware") or answer.get("phishing"):
+            return max(score, 90), 0.8
+        return score, 0.6
+
+
+PROVIDERS = {
+    "umbrella": UmbrellaProvider,
+    "whoisxml": WhoisXMLProvider,
+    "ipqualityscore": IPQualityScoreProvider
+}
+
+
+class ReputationEngine:
+    """ Runs the providers in parallel and merges their verdicts
+
+    Parameters
+    ----------
+    providers: list
+        Provider objects
+    short_circuit_score, short_circuit_confidence: float
+        A verdict with at least this score and confidence stops the other lookups, 0 to always wait for all of them
+    malicious_score, clean_score: float
+        Merged scores from which a domain is considered malicious (url_status -1) or clean (url_status 1), unknown
+        (url_status 0) in between
+    """
+
+    def __init__(self, providers, short_circuit_score=90, short_circuit_confidence=0.8, malicious_score=75,
+                 clean_score=25):
+        self.providers = providers
+        self.short_circuit_score = short_circuit_score
+        self.short_circuit_confidence = short_circuit_confidence
+        self.malicious_score = malicious_score
+        self.clean_score = clean_score
+
+    def is_conclusive(self, verdict):
+        return (self.short_circuit_score > 0 and verdict["score"] >= self.short_circuit_score
+                and verdict["confidence"] >= self.short_circuit_confidence)
+
+    def merge(self, domain, verdicts):
+        """ Merges the verdicts into a single score, weighted by the confidence and the weight of each provider
+        """
+        weights = {provider.name: provider.weight for provider in self.providers}
+        total = sum(weights[v["provider"]] * v["confidence"] for v in verdicts)
+        if total == 0:
+            score = None
+            status = 0
+        else:
+            score = round(sum(weights[v["provider"]] * v["confidence"] * v["score"] for v in verdicts) / total, 1)
+            if score >= self.malicious_score:
+                status = -1
+            elif score <= self.clean_score:
+                status = 1
+            else:
+                status = 0
+        return {"domain": domain, "merged_score": score, "merged_status": status, "verdicts": verdicts}
+
+    async def check(self, domain):
+        """ Asks all the providers about a domain, returns the merged verdict
+        """
+        tasks = [asyncio.ensure_future(provider.verdict(domain)) for provider in self.providers]
+        verdicts = []
+        try:
+            for task in asyncio.as_completed(tasks):
+                verdict = await task
+                if verdict is None:
+                    continue
+                verdicts.append(verdict)
+                if self.is_conclusive(verdict):
+                    # No need to wait for the other providers
+                    break
+        finally:
+            for task in tasks:
+                task.cancel()
+        return self.merge(domain, verdicts)
+
+    async def check_many(self, domains):
+        """ Checks several domains at the same time, returns a dictionary with the merged verdict of each one
+        """
+        domains = list(dict.fromkeys(domains))
+        results = await asyncio.gather(*[self.check(domain) for domain in domains])
+        return dict(zip(domains, results))
+
+    def close(self):
+        for provider in self.providers:
+            provider.close()
+
+
+_engine = None
+_lock = threading.Lock()
+
+
+def get_engine():
+    """ Returns the engine shared by all the scripts, with the providers enabled in REPUTATION_ENGINE in env.py. It is
+    created on first use, so the quota of each provider applies to all the lookups of the run
+    """
+    global _engine
+    with _lock:
+        if _engine is None:
+            providers = []
+            for name, options in settings.get("providers", {"umbrella": {}}).items():
+                providers.append(PROVIDERS[name](
+                    name, weight=options.get("weight", 1.0), timeout=options.get("timeout", 10),
+                    per_second=options.get("requests_per_second", 0), per_day=options.get("requests_per_day", 0)))
+            _engine = ReputationEngine(providers,
+                                       short_circuit_score=settings.get("short_circuit_score", 90),
+                                       short_circuit_confidence=settings.get("short_circuit_confidence", 0.8),
+                                       malicious_score=settings.get("malicious_score", 75),
+                                       clean_score=settings.get("clean_score", 25))
+            # The daily quotas are saved when the scripts end
+            atexit.register(_engine.close)
+        return _engine
+
+
+def check_domains(domains):
+    """ Checks a list of domains against all the providers (sync wrapper), returns a dictionary with the merged
+    verdict of each domain
+    """
+    return asyncio.run(get_engine().check_many(domains))
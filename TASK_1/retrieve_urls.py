@@ -13,140 +13,55 @@ or implied.
 """
 
 """ Retrieves the DNS records from Cyber Vision 
-This script uses the function retrieve_urls() to retrieve all components and their flows from Cyber Vision.
+This script uses the function retrieve_urls() to retrieve the domains queried in the DNS flows of Cyber Vision.
 Then it creates a json file and also returns the same dictionary with all of the domains, the last time they were accessed, and the IP address.
+The json file is written as NDJSON (one record per line, appended as the flows are retrieved) unless OUTPUT in the env file says otherwise.
+The flows are walked by flow_scan.py, which collects the DNS records for this script and the public IPs for get_cv_ip.py
+in a single pass, so running TASK_1_1 and TASK_1_2 does not request every flow twice.
+After each scan a cursor (the latest firstActivity seen and the ids of the flows already retrieved) is saved in a json file,
+so the next scan only asks Cyber Vision for the flows that are newer than it. Delete the cursor file to retrieve everything again.
 """
 
 
-import requests
-import json
 from env import *
-from datetime import datetime
-base_url = CYBERVISION.get("base_url")
-token = CYBERVISION.get('x-token-id')
-components_url = base_url+"/components"
-
-
-
-headers = {
-  'x-token-id': token
-}
+from ndjson_io import RecordWriter, read_records
+from flow_scan import take_pending
 
 
 check_period = PERIOD.get('period')
-current_date = datetime.now().strftime("%Y/%m/%d %H:%M:%S")
-current_date = datetime.strptime(current_date, "%Y/%m/%d %H:%M:%S")
-dns_server_components=[]
-dns_flows = []
+output_format = OUTPUT.get('format', 'ndjson')
 
-mydict= {'domain':'', 'time':'', 'IP':''}
-mylist=[]
 
+#The FUNCTION BELOW :
+#   1. Scans the flows newer than the cursor of the previous scan (and within the period given, if any),
+#      unless a recent scan (e.g. from TASK_1_2) has already collected the DNS records
+#   2. Gets the domains question in the Flows with DNS tag (with IPs and time first Seen), and saves them in a JSON file.
+#   3. The function returns a list of dictionaries, each dictionary containing a domain, its time and associated IP address
 
-#This functin converts a timestamp to a readable date/time value
-def convert_to_time(timestamp):
-    timestamp = str(timestamp)
-    timestamp = int(timestamp[0 :10])
-    dt_object = datetime.fromtimestamp(timestamp)
-    return dt_object
+def retrieve_new_urls(days=None):
 
-#The FUNCTION BELOW :
-#   1. Retrieves all components
-#   2. Retrieves The Flows for Components with DNS_SERVER tags
-#   3. Gets the Flows with DNS tag and gets the domains question in those flows (with IPs and time first Seen), and saves them in a JSON file.
-#   4. The function returns a list of dictionaries, each dictionary containing a domain, its time and associated IP address
+    if take_pending('dns', "domains_urls.json", days):
 
-def retrieve_urls_ALL():
+        # The scan always writes NDJSON, convert the file if the older format is configured
+        if output_format != 'ndjson':
+            records = list(read_records("domains_urls.json"))
+            with RecordWriter("domains_urls.json", output_format) as writer:
+                for record in records:
+                    writer.write(record)
 
-    components = requests.get(components_url, headers = headers, verify= False)
-
-    if components.status_code == 200:
-    
-        for c in components.json():   
-                    if  c['tags']: 
-                        if c['tags'][0]['id'] == "DNS_SERVER":
-                            dns_server_components.append(c['id'])
-
-        # Get the flows for Each Component with DNS Server Tag
-        for component in dns_server_components:
-                flow_url = components_url+"/"+component+"/flows"
-                response = requests.get(flow_url, headers = headers, verify = False)
-                
-                for flow in response.json():
-                    if flow['tags']:
-                        if flow['tags'][0]['id']=='DNS':
-                            dns_flows.append(flow['id'])
-
-        # For each flow with DNS tag, capture the domain queried, ip and time for First activity
-        for flow in dns_flows:
-            url = base_url+"/flows/"+flow
-            resp = requests.get(url, headers = headers, verify = False)
-            mydict['domain']=resp.json()['properties'][0]['value']
-            mydict['IP']=resp.json()['left']['ip']
-            time = convert_to_time(resp.json()['firstActivity'])
-            mydict['time']= str(time)
-            mylist.append(mydict.copy())
-
-            with open("domains_urls.json", "w") as f:
-                f.write(json.dumps(mylist, indent=2))
-                f.close()
-            
-    
-        return mylist
-    else:
-        print("HTTP Error",components.status_code, "ENCOUNTERED")
+        return list(read_records("domains_urls.json"))
 
 
+#The FUNCTIONS BELOW :
+#  retrieve_urls_ALL() looks at all the flows that are newer than the cursor, periodic_retrieve_urls() records only
+#  flows within a Specified duration. The user specifies Period they want in the env file.
 
-#The FUNCTION BELOW :
-#  works almost similarly to the one above, However, this one records only flows within a Specified duration. 
-# The user specifies Period they want in the env file.
+def retrieve_urls_ALL():
+    return retrieve_new_urls()
 
 
 def periodic_retrieve_urls():
-    
-        components = requests.get(components_url, headers = headers, verify= False)
-
-        if components.status_code == 200:
-            for c in components.json():   
-                        if  c['tags']: 
-                            if c['tags'][0]['id'] == "DNS_SERVER":
-                                dns_server_components.append(c['id'])
-
-            # Get the flows for Each Component with DNS Server Tag
-            for component in dns_server_components:
-                    flow_url = components_url+"/"+component+"/flows"
-                    response = requests.get(flow_url, headers = headers, verify = False)
-                    
-                    for flow in response.json():
-                        if flow['tags']:
-                            if flow['tags'][0]['id']=='DNS':
-                                dns_flows.append(flow['id'])
-
-            # For each flow with DNS tag, capture the domain queried, ip and time for First activity
-            for flow in dns_flows: 
-                url = base_url+"/flows/"+flow
-                resp = requests.get(url, headers = headers, verify = False)
-
-                time = convert_to_time(resp.json()['firstActivity'])
-                activity_time = datetime.strptime(str(time), "%Y-%m-%d %H:%M:%S")
-                # Time difference between the current time and the time of the flow as retrieved from CV.
-                time_diff = current_date - activity_time
-
-                if time_diff.days <= check_period:
-
-                    mydict['domain']=resp.json()['properties'][0]['value']
-                    mydict['IP']=resp.json()['left']['ip']
-                    mydict['time']= str(time)
-                    mylist.append(mydict.copy())
-
-                    with open("domains_urls.json", "w") as f:
-                        f.write(json.dumps(mylist, indent=2))
-                        f.close()
-                
-            return mylist
-        else:
-            print("HTTP Error",components.status_code, "ENCOUNTERED")
+    return retrieve_new_urls(check_period)
 
 
 def retrieve_urls():
@@ -163,5 +78,6 @@ def retrieve_urls():
 #Before Calling Any of the above functions to retrieve domains from CV, we check whether the user specified the Period.
 #If the period is specified, we call the second function, periodic_retrieve_urls(), to get just specific urls
 #Else, we call the retrieve_urls_all, which retrieves all domains from CV
+#In both cases, only the flows that have not been retrieved by a previous scan are requested
 
 #retrieve_urls()
\ No newline at end of file
@@ -0,0 +1,139 @@
+"""
+Copyright (c) 2021 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+""" Tests of the log-structured domains DB (domains_log.py): recovery after a crash while writing or compacting, and
+same answers as the SQLite backend (domains_store.py)
+Run from the root of the repository with: python3 -m pytest -q TASK_1
+"""
+
+import os
+import sys
+
+import pytest
+
+# env.py is in the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import domains_log
+from domains_log import DomainsLog
+from domains_store import DomainsStore
+
+# (domain, IP, time), more queries than keep_queries for the first domain, over several days and IPs
+QUERIES = ([("bad.example.com", "10.0.0." + str(i % 7), "2021-04-" + str(20 + i % 3) + " 16:00:" + str(10 + i))
+            for i in range(12)]
+           + [("unknown.example.org", "10.0.1.1", "2021-04-22 17:00:00"),
+              ("unknown.example.org", "10.0.1.2", "2021-04-23 09:30:00")])
+DOMAINS = sorted({domain for domain, _, _ in QUERIES})
+
+
+def fill(store, queries=QUERIES):
+    for domain, ip, time in queries:
+        store.add_query(domain, ip, time)
+    store.commit()
+
+
+def snapshot_of(store):
+    return {domain: store.get(domain) for domain in DOMAINS}
+
+
+def test_torn_last_line_is_dropped(tmp_path):
+    path = str(tmp_path / "log")
+    db = DomainsLog(path, keep_queries=5)
+    fill(db)
+    expected = snapshot_of(db)
+    db.segment.close()
+
+    # Crash in the middle of the next write: a partial line at the end of the segment
+    segment = db.segment_path(db.generation)
+    size = os.path.getsize(segment)
+    with open(segment, "ab") as f:
+        f.write(b'{"op":"q","d":"bad.exam')
+
+    db = DomainsLog(path, keep_queries=5)
+    assert snapshot_of(db) == expected
+    assert os.path.getsize(segment) == size
+
+    # The next change is not glued to the partial line
+    db.add_query("bad.example.com", "10.0.0.9", "2021-04-24 08:00:00")
+    db.commit()
+    db.segment.close()
+    db = DomainsLog(path, keep_queries=5)
+    assert db.last_query("bad.example.com") == {"IP": "10.0.0.9", "time": "2021-04-24 08:00:00"}
+
+
+def test_compaction_interrupted_after_replace(tmp_path, monkeypatch):
+    path = str(tmp_path / "log")
+    db = DomainsLog(path, keep_queries=5)
+    fill(db)
+    db.mark_pushed("bad.example.com", 1619100000)
+    db.commit()
+    expected = snapshot_of(db)
+    old_segment = db.segment_path(db.generation)
+
+    # Crash once the new snapshot is in place, before the old segment is removed
+    def crash(path):
+        raise KeyboardInterrupt("crash")
+    monkeypatch.setattr(domains_log.os, "remove", crash)
+    with pytest.raises(KeyboardInterrupt):
+        db.compact()
+    monkeypatch.undo()
+    assert os.path.exists(old_segment)
+
+    # The old segment is already in the snapshot, it must not be replayed twice
+    db = DomainsLog(path, keep_queries=5)
+    assert snapshot_of(db) == expected
+    assert db.last_pushed(["bad.example.com"]) == {"bad.example.com": 1619100000}
+    assert not os.path.exists(old_segment)
+
+    fill(db, [("bad.example.com", "10.0.0.8", "2021-04-25 10:00:00")])
+    db.segment.close()
+    db = DomainsLog(path, keep_queries=5)
+    assert db.get("bad.example.com")["count"] == expected["bad.example.com"]["count"] + 1
+
+
+def test_compaction_interrupted_before_replace(tmp_path, monkeypatch):
+    path = str(tmp_path / "log")
+    db = DomainsLog(path, keep_queries=5)
+    fill(db)
+    db.compact()
+    fill(db, [("unknown.example.org", "10.0.1.3", "2021-04-24 11:00:00")])
+    expected = snapshot_of(db)
+
+    # Crash while the new snapshot is written: the previous snapshot and its segment are still used
+    def crash(src, dst):
+        raise KeyboardInterrupt("crash")
+    monkeypatch.setattr(domains_log.os, "replace", crash)
+    with pytest.raises(KeyboardInterrupt):
+        db.compact()
+    monkeypatch.undo()
+    db.segment.close()
+
+    db = DomainsLog(path, keep_queries=5)
+    assert snapshot_of(db) == expected
+
+
+def test_same_answers_as_sqlite(tmp_path):
+    sqlite_db = DomainsStore(str(tmp_path / "domains.sqlite"), keep_queries=5)
+    log_db = DomainsLog(str(tmp_path / "log"), keep_queries=5)
+    fill(sqlite_db)
+    fill(log_db)
+    assert snapshot_of(log_db) == snapshot_of(sqlite_db)
+    assert log_db.get("never.example.net") is None and sqlite_db.get("never.example.net") is None
+
+    # Also once the log has been compacted and opened again
+    log_db.compact()
+    log_db.segment.close()
+    log_db = DomainsLog(str(tmp_path / "log"), keep_queries=5)
+    assert snapshot_of(log_db) == snapshot_of(sqlite_db)
+    sqlite_db.db.close()
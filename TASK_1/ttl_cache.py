@@ -0,0 +1,113 @@
+"""
+Copyright (c) 2021 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+""" Cache of API answers that expire after some time
+This script has a two-level cache used to avoid asking the same question to an API (e.g. Umbrella) again:
+- a small in-memory LRU of the most recently used entries, for repeated lookups within a run
+- a SQLite file behind it, so the answers are kept between runs
+Every entry is stored with its own time to live, chosen by the caller when the entry is added.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """ In-memory LRU in front of a persistent SQLite table, with an expiry time for every entry
+
+    Parameters
+    ----------
+    path: str
+        The SQLite file, created if it does not exist
+    table: str
+        The table used for this cache, several caches can share the same file
+    memory_entries: int
+        Maximum number of entries kept in memory
+    """
+
+    def __init__(self, path, table, memory_entries=10000):
+        self.table = table
+        self.memory_entries = memory_entries
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS " + table + " (key TEXT PRIMARY KEY, value TEXT, expires INTEGER)")
+
+    def get(self, key):
+        """ Returns the value stored for the key, or None if there is none or it has expired
+        """
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is None:
+                row = self.db.execute("SELECT value, expires FROM " + self.table + " WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    entry = (json.loads(row[0]), row[1])
+                    self.remember(key, entry)
+            else:
+                self.memory.move_to_end(key)
+
+            if entry is None or entry[1] < now:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[0]
+
+    def get_stale(self, key):
+        """ Returns the value stored for the key even if it has expired, or None if there is none. Used when the API
+        cannot be reached
+        """
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is None:
+                row = self.db.execute("SELECT value, expires FROM " + self.table + " WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    entry = (json.loads(row[0]), row[1])
+            return None if entry is None else entry[0]
+
+    def put(self, key, value, ttl):
+        """ Stores a value for ttl seconds
+        """
+        entry = (value, int(time.time() + ttl))
+        with self.lock:
+            self.remember(key, entry)
+            self.db.execute("INSERT OR REPLACE INTO " + self.table + " (key, value, expires) VALUES (?, ?, ?)",
+                            (key, json.dumps(value), entry[1]))
+
+    def remember(self, key, entry):
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+        if len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def purge(self):
+        """ Removes the expired entries from the file
+        """
+        with self.lock:
+            self.db.execute("DELETE FROM " + self.table + " WHERE expires < ?", (int(time.time()),))
+
+    def commit(self):
+        with self.lock:
+            self.db.commit()
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return (100.0 * self.hits / total) if total else 0
@@ -0,0 +1,322 @@
+"""
+Copyright (c) 2021 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+""" Rate-limited client for the Umbrella Investigate API
+All the calls to Investigate (get_reputation.py, ip_get_domain.py) go through a single client that:
+- never sends more requests than the subscription allows, per second and per day (token bucket, UMBRELLA_LIMITS in env.py)
+- never runs more than a given number of requests at the same time
+- waits and retries when Investigate answers 429 or 5xx, respecting the Retry-After header
+- raises UmbrellaError when a call finally fails, instead of returning an error body that the scripts would read as data
+- stops sending requests for a while when Investigate keeps failing (circuit breaker, see circuit_breaker.py), the
+  calls then raise CircuitOpen at once instead of waiting for their timeout
+- optionally sends a second copy of a GET request that takes too long to answer (hedged request), and uses whichever
+  answer arrives first, if the rate limit and the daily quota leave room for it
+The client runs on its own asyncio event loop, in a background thread. It can be used from normal code (request())
+or from asyncio code running on any event loop (arequest()).
+"""
+
+import asyncio
+import atexit
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+import env
+from api_client import ApiClient, RETRY_STATUS
+from circuit_breaker import get_breaker
+
+
+class UmbrellaError(Exception):
+    """ An Investigate call that failed, after all the retries
+    """
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+    def is_transient(self):
+        """ Whether the call may work later: Investigate could not be reached, was too busy or the quota is used up
+        """
+        return self.status_code is None or self.status_code in RETRY_STATUS
+
+
+class QuotaExceeded(UmbrellaError):
+    """ The daily quota of the subscription has been used up
+    """
+
+
+class CircuitOpen(UmbrellaError):
+    """ Investigate has failed too many times in a row, the request has not been sent
+    """
+
+
+class TokenBucket:
+    """ Limits the number of requests per second and per day
+
+    Parameters
+    ----------
+    per_second: float
+        Requests allowed per second, on average
+    per_day: int
+        Requests allowed per day, 0 for no daily limit
+    quota_file: str
+        File where the number of requests of the day is kept between runs
+    """
+
+    def __init__(self, per_second, per_day=0, quota_file=None):
+        self.rate = float(per_second)
+        self.capacity = max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.per_day = int(per_day or 0)
+        self.quota_file = quota_file
+        self.day, self.used = self.load_quota()
+
+    def load_quota(self):
+        today = date.today().isoformat()
+        if self.quota_file and os.path.exists(self.quota_file):
+            with open(self.quota_file, "r") as f:
+                quota = json.load(f)
+            if quota.get("day") == today:
+                return today, int(quota.get("used", 0))
+        return today, 0
+
+    def save_quota(self):
+        if self.quota_file:
+            with open(self.quota_file, "w") as f:
+                json.dump({"day": self.day, "used": self.used}, f)
+
+    def quota_left(self):
+        today = date.today().isoformat()
+        if today != self.day:
+            self.day, self.used = today, 0
+        return not self.per_day or self.used < self.per_day
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def count(self):
+        self.used += 1
+        if self.used % 50 == 0:
+            self.save_quota()
+
+    async def acquire(self):
+        """ Waits until a request can be sent
+        """
+        if not self.quota_left():
+            raise QuotaExceeded("Daily quota of " + str(self.per_day) + " Investigate requests used up")
+
+        # No limit per second, only the daily quota
+        while self.rate > 0:
+            self.refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                break
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+        self.count()
+
+    def try_acquire(self):
+        """ Takes a token only if a request can be sent right now, without waiting. Returns whether it was taken
+        """
+        if not self.quota_left():
+            return False
+        if self.rate > 0:
+            self.refill()
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+        self.count()
+        return True
+
+
+class UmbrellaClient:
+    """ Investigate client with rate limiting, a concurrency cap and retries
+
+    Parameters
+    ----------
+    base_url: str
+        Investigate url, e.g. https://investigate.api.umbrella.com
+    token: str
+        Investigate API token
+    per_second, per_day: int
+        Quota of the subscription (see TokenBucket)
+    max_concurrency: int
+        Maximum number of requests running at the same time
+    max_retries: int
+        Number of times a call answered with 429 or 5xx is retried
+    timeout: float
+        Seconds to wait for Investigate to answer
+    hedge_after: float
+        Seconds after which a second copy of a GET request is sent if the first one has not been answered, 0 to never
+        send one
+    """
+
+    def __init__(self, base_url, token, per_second=10, per_day=0, max_concurrency=8, max_retries=5, timeout=30,
+                 quota_file=None, hedge_after=0):
+        self.base_url = base_url.rstrip("/")
+        self.max_retries = max_retries
+        self.max_concurrency = max_concurrency
+        # Pooled connections, the retries are done here so that they also wait for the rate limit
+        self.http = ApiClient(headers={"Authorization": "Bearer " + token}, pool_size=max_concurrency,
+                              timeout=timeout, max_retries=0)
+        self.bucket = TokenBucket(per_second, per_day, quota_file)
+        # Threads sending the requests, with room for the hedged copies
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency * 2)
+        self.breaker = get_breaker("Umbrella Investigate")
+        self.hedge_after = hedge_after
+        self.hedged = 0
+        self.loop = None
+        self.semaphore = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        """ Starts the event loop of the client in a background thread, on first use
+        """
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                self.semaphore = asyncio.Semaphore(self.max_concurrency)
+                threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        return self.loop
+
+    async def _send(self, method, path, **kwargs):
+        """ Sends a request in a thread of the executor. A GET request that has not been answered after hedge_after
+        seconds is sent a second time, the first answer is used
+        """
+        loop = asyncio.get_running_loop()
+
+        def call():
+            return self.http.session.request(method, self.base_url + path, timeout=self.http.timeout, **kwargs)
+
+        first = loop.run_in_executor(self.executor, call)
+        if not self.hedge_after or method != "GET":
+            return await first
+
+        done, _ = await asyncio.wait({first}, timeout=self.hedge_after)
+        if done:
+            return first.result()
+
+        # The second copy also counts for the rate limit. It is only sent if there is room for it right now, otherwise
+        # keep waiting for the first one
+        if not self.bucket.try_acquire():
+            return await first
+        self.hedged += 1
+        pending = {first, loop.run_in_executor(self.executor, call)}
+        while True:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                # If one of them fails, wait for the other one
+                if future.exception() is None or not pending:
+                    return future.result()
+
+    async def _request(self, method, path, **kwargs):
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                raise CircuitOpen("Investigate is not answering, request to " + path + " not sent")
+
+            try:
+                async with self.semaphore:
+                    await self.bucket.acquire()
+                    try:
+                        response = await self._send(method, path, **kwargs)
+                    except QuotaExceeded:
+                        # Not a failure of Investigate
+                        raise
+                    except Exception as e:
+                        # Connection errors and timeouts are retried like 5xx errors
+                        response = None
+                        error = e
+            except BaseException:
+                # Quota used up or request cancelled, Investigate did not answer but did not fail either
+                self.breaker.release()
+                raise
+
+            # 429 means that the quota is used up, not that Investigate is failing
+            if response is None or response.status_code >= 500:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+
+            if response is not None and response.status_code not in RETRY_STATUS:
+                if response.status_code != 200:
+                    raise UmbrellaError("Error " + str(response.status_code) + " in the API Request to " + path,
+                                        response.status_code)
+                try:
+                    return response.json()
+                except ValueError:
+                    raise UmbrellaError("Invalid answer from Investigate to " + path, response.status_code)
+
+            if attempt >= self.max_retries:
+                if response is None:
+                    raise UmbrellaError("Investigate request to " + path + " failed: " + str(error))
+                if response.status_code == 429:
+                    print("You have exceeded the number of API calls allowed for your account")
+                raise UmbrellaError("Error " + str(response.status_code) + " in the API Request to " + path,
+                                    response.status_code)
+
+            await asyncio.sleep(self.http.get_wait_time(response, attempt))
+            attempt += 1
+
+    def submit(self, coro):
+        """ Runs a coroutine on the event loop of the client, returns a concurrent.futures.Future
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.start())
+
+    def run(self, coro):
+        """ Runs a coroutine on the event loop of the client and waits for its result (sync wrapper)
+        """
+        return self.submit(coro).result()
+
+    async def arequest(self, method, path, **kwargs):
+        """ Makes an Investigate call from asyncio code running on any event loop, returns the json answer
+        """
+        return await asyncio.wrap_future(self.submit(self._request(method, path, **kwargs)))
+
+    def request(self, method, path, **kwargs):
+        """ Makes an Investigate call and waits for the json answer
+        """
+        return self.run(self._request(method, path, **kwargs))
+
+    def close(self):
+        self.bucket.save_quota()
+
+
+_umbrella_client = None
+_lock = threading.Lock()
+
+
+def get_umbrella_client():
+    """ Returns the Investigate client shared by all the scripts, as configured in env.py
+    """
+    global _umbrella_client
+    with _lock:
+        if _umbrella_client is None:
+            limits = getattr(env, "UMBRELLA_LIMITS", {})
+            _umbrella_client = UmbrellaClient(
+                env.UMBRELLA["inv_url"], env.UMBRELLA["inv_token"],
+                per_second=limits.get("requests_per_second", 10),
+                per_day=limits.get("requests_per_day", 0),
+                max_concurrency=int(limits.get("max_concurrency", 8)),
+                max_retries=int(limits.get("max_retries", 5)),
+                timeout=limits.get("timeout", 30),
+                quota_file=limits.get("quota_file", "umbrella_quota.json"),
+                hedge_after=limits.get("hedge_after", 0)
+            )
+            atexit.register(_umbrella_client.close)
+        return _umbrella_client
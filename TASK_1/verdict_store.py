@@ -0,0 +1,129 @@
+"""
+Copyright (c) 2021 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+               https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+""" Single store for the results of the 3rd party reputation checks
+The results of 3rdpartychecks.py used to be saved in one json file per lookup (whois_<domain>.json,
+ipscore_<domain>.json). They are now all kept in one SQLite table, indexed by (provider, target, timestamp), so:
+- the latest result of a target can be found without scanning a directory
+- a target checked recently is not requested again (see VERDICT_STORE in env.py)
+- every result is kept, so the history of a target can be queried
+The json files left by previous versions can be loaded once with import_legacy_files(), or by running this script.
+"""
+
+import glob
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import env
+
+settings = getattr(env, "VERDICT_STORE", {})
+
+# Prefix of the json files written by previous versions, for each provider
+LEGACY_FILES = {"whoisxml": "whois_", "ipqualityscore": "ipscore_"}
+
+
+class VerdictStore:
+    """ Results of the reputation providers, in a SQLite table
+
+    Parameters
+    ----------
+    path: str
+        The SQLite file, created if it does not exist
+    """
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS verdicts (provider TEXT, target TEXT, checked_at INTEGER, "
+                        "result TEXT)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS verdicts_lookup ON verdicts (provider, target, checked_at)")
+        self.db.commit()
+
+    def add(self, provider, target, result, checked_at=None):
+        """ Stores the result of a lookup
+        """
+        checked_at = int(time.time() if checked_at is None else checked_at)
+        with self.lock:
+            self.db.execute("INSERT INTO verdicts (provider, target, checked_at, result) VALUES (?, ?, ?, ?)",
+                            (provider, target, checked_at, json.dumps(result)))
+            self.db.commit()
+
+    def latest(self, provider, target, max_age=None):
+        """ Returns the latest result of a provider for a target, or None if there is none or it is older than max_age
+        seconds
+        """
+        since = 0 if max_age is None else int(time.time() - max_age)
+        with self.lock:
+            row = self.db.execute("SELECT result FROM verdicts WHERE provider = ? AND target = ? AND checked_at >= ? "
+                                  "ORDER BY checked_at DESC LIMIT 1", (provider, target, since)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def history(self, provider, target):
+        """ Returns all the results of a provider for a target, as a list of (timestamp, result), oldest first
+        """
+        with self.lock:
+            rows = self.db.execute("SELECT checked_at, result FROM verdicts WHERE provider = ? AND target = ? "
+                                   "ORDER BY checked_at", (provider, target)).fetchall()
+        return [(checked_at, json.loads(result)) for checked_at, result in rows]
+
+    def import_legacy_files(self, directory="."):
+        """ Loads the json files written by previous versions, with the time they were written. Returns the number of
+        files loaded. The files are left in place
+        """
+        count = 0
+        for provider, prefix in LEGACY_FILES.items():
+            for path in glob.glob(os.path.join(directory, prefix + "*.json")):
+                target = os.path.basename(path)[len(prefix):-len(".json")]
+                with open(path, "r", encoding="utf-8") as f:
+                    try:
+                        result = json.load(f)
+                    except ValueError:
+                        print("Skipping " + path + ", it is not valid json")
+                        continue
+                checked_at = int(os.path.getmtime(path))
+                with self.lock:
+                    exists = self.db.execute("SELECT 1 FROM verdicts WHERE provider = ? AND target = ? AND "
+                                             "checked_at = ?", (provider, target, checked_at)).fetchone()
+                if exists is None:
+                    self.add(provider, target, result, checked_at)
+                    count += 1
+        return count
+
+
+_verdict_store = None
+_lock = threading.Lock()
+
+
+def get_verdict_store():
+    """ Returns the store shared by all the scripts, as configured in env.py
+    """
+    global _verdict_store
+    with _lock:
+        if _verdict_store is None:
+            _verdict_store = VerdictStore(settings.get("file", "verdicts.sqlite"))
+        return _verdict_store
+
+
+def get_max_age():
+    """ Seconds during which a stored result is used instead of asking the provider again
+    """
+    return settings.get("max_age_hours", 24) * 3600
+
+
+if __name__ == "__main__":
+    print(str(get_verdict_store().import_legacy_files()) + " json files loaded into the verdict store")
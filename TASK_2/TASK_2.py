@@ -31,10 +31,10 @@ Lastly, there is the function grouping_algorithm which does the entire process o
 """
 
 import json
-import requests
 import os, sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import env as config 
+from api_client import get_cybervision_client
 from helper_functions import make_secure_api_call, get_comp_no_groups, get_ungrouped_components_vendors
 
 base_url = config.CYBERVISION["base_url"]
@@ -142,7 +142,7 @@ def update_group(components, groupId):
     }
 
     try:  
-        response = requests.patch(url=base_url+endpoint_url, headers=headers, data=json.dumps(payload), verify=False)
+        response = get_cybervision_client().patch(url=base_url+endpoint_url, headers=headers, data=json.dumps(payload))
         data = response.json()
     except Exception as e:
         print(response.status_code)
@@ -174,7 +174,7 @@ def create_group(label, description, comment):
         "label" : label,
         "locked" : False
     }
-    response = requests.post(url=base_url+endpoint_url, headers=headers, data=json.dumps(payload), verify=False, allow_redirects=False)
+    response = get_cybervision_client().post(url=base_url+endpoint_url, headers=headers, data=json.dumps(payload), allow_redirects=False)
     data = response.json()
     
     return data["id"]
@@ -18,7 +18,7 @@ or implied.
 """ Helper script for automated_grouping.py
 
 This script includes different get calls that are made to the CyberVision API and used for the automated grouping:
-- make_secure_api_call: make API call with errorhandling
+- make_secure_api_call: make API call with errorhandling, through the pooled client shared by all scripts (api_client.py)
 - get_comp_no_groups: retrieves a list all ungrouped components
 - get_ungrouped_components_vendors: retrieves a list of the vendors that the ungrouped components have
 
@@ -27,6 +27,7 @@ This script includes different get calls that are made to the CyberVision API an
 import json
 import requests
 import env as config 
+from api_client import get_cybervision_client
 
 base_url = config.CYBERVISION["base_url"]
 my_token = config.CYBERVISION["x-token-id"]
@@ -45,9 +46,8 @@ def make_secure_api_call(url, headers = {}):
         The headers used in the api call
     """
     try:
-        response = requests.get(url, headers = headers, verify = False)
-        if response.status_code == 429:
-            print("You have exceeded the number of API calls allowed")
+        # Calls that hit the rate limit are retried by the client before giving up
+        response = get_cybervision_client().get(url, headers = headers)
     except requests.exceptions.RequestException as e:
         raise SystemExit(e)
     
@@ -0,0 +1,154 @@
+"""
+Copyright (c) 2021 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+""" Shared HTTP client for the Cyber Vision API
+
+Every script used to call requests.get/post/patch directly, opening a new connection for each call.
+This script has a client object that keeps the connections open and reuses them, and retries the calls that fail:
+- ApiClient: keep-alive connection pool with timeouts, shared headers, and exponential backoff on 429 and 5xx
+    errors (the Retry-After header sent by the server is respected)
+- get_cybervision_client: returns the client used by all the scripts, created on first use with the
+    settings in env.py (CYBERVISION and HTTP)
+"""
+
+import time
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+import env as config
+
+# Status codes that are worth retrying, the server is busy or temporarily failing
+RETRY_STATUS = [429, 500, 502, 503, 504]
+
+# POST and PATCH calls are only retried when the server says it did not process them
+RETRY_STATUS_NOT_IDEMPOTENT = [429]
+
+
+class ApiClient:
+    """ Pooled HTTP client with retries
+
+    Parameters
+    ----------
+    headers: dict
+        Headers sent with every call (e.g. the authentication token)
+    pool_size: int
+        Maximum number of connections kept open to the server
+    timeout: float
+        Seconds to wait for the server to answer before giving up
+    max_retries: int
+        Number of times a failed call is retried
+    backoff_factor: float
+        Seconds to wait before the first retry, doubled for every following retry
+    verify: bool
+        Whether to verify the TLS certificate of the server
+    """
+
+    def __init__(self, headers=None, pool_size=10, timeout=30, max_retries=5, backoff_factor=0.5, verify=True):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.verify = verify
+
+        self.session = requests.Session()
+        self.session.headers.update(headers or {})
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def get_wait_time(self, response, attempt):
+        """ Seconds to wait before the next attempt, from the Retry-After header if the server sent one
+        """
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after:
+            if retry_after.isdigit():
+                return int(retry_after)
+            try:
+                date = parsedate_to_datetime(retry_after)
+                return max(0, (date - datetime.now(timezone.utc)).total_seconds())
+            except (TypeError, ValueError):
+                pass
+        return self.backoff_factor * (2 ** attempt)
+
+    def request(self, method, url, **kwargs):
+        """ Makes an API call, retrying it when the server is busy or the connection fails
+
+        Parameters
+        ----------
+        method: str
+            HTTP method, e.g. "GET"
+        url: str
+            The url to make the api call
+        kwargs:
+            Any other argument accepted by requests (params, json, data, headers...)
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        kwargs.setdefault("verify", self.verify)
+        idempotent = method.upper() in ["GET", "HEAD", "OPTIONS", "PUT", "DELETE"]
+        retry_status = RETRY_STATUS if idempotent else RETRY_STATUS_NOT_IDEMPOTENT
+
+        attempt = 0
+        while True:
+            response = None
+            try:
+                response = self.session.request(method, url, **kwargs)
+                if response.status_code not in retry_status or attempt >= self.max_retries:
+                    if response.status_code == 429:
+                        print("You have exceeded the number of API calls allowed")
+                    return response
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                # The call may have reached the server, only retry it if repeating it is safe
+                if not idempotent or attempt >= self.max_retries:
+                    raise
+
+            time.sleep(self.get_wait_time(response, attempt))
+            attempt += 1
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request("PATCH", url, **kwargs)
+
+
+_cybervision_client = None
+_lock = threading.Lock()
+
+
+def get_cybervision_client():
+    """ Returns the client shared by all the scripts that call the Cyber Vision API
+    """
+    global _cybervision_client
+    with _lock:
+        if _cybervision_client is None:
+            settings = getattr(config, "HTTP", {})
+            # Keep at least one connection per worker thread (see TASK_1/flow_fetcher.py)
+            workers = getattr(config, "CONCURRENCY", {}).get("workers") or 1
+            _cybervision_client = ApiClient(
+                headers={"x-token-id": config.CYBERVISION["x-token-id"]},
+                pool_size=max(int(settings.get("pool_size", 10)), int(workers)),
+                timeout=settings.get("timeout", 30),
+                max_retries=settings.get("max_retries", 5),
+                backoff_factor=settings.get("backoff_factor", 0.5),
+                verify=False
+            )
+        return _cybervision_client
@@ -16,9 +16,26 @@ UMBRELLA = {
     "en_url": "https://s-platform.api.opendns.com/1.0/",
     "inv_url": "https://investigate.api.umbrella.com", 
     "inv_token": "<insert investigate token>",
-    "en_key": "<insert enforcement_key>"
+    "en_key": "<insert enforcement_key>",
+    # Number of domains sent in each bulk categorization request (Investigate accepts up to 1000)
+    "bulk_size": 1000
     }
 
+# Limits of the Investigate subscription. Requests are spread so that no more than 'requests_per_second' are sent,
+# and stop for the day after 'requests_per_day' (0 = no daily limit). The number of requests of the day is kept in
+# 'quota_file' between runs. Calls answered with 429 or 5xx errors are retried up to 'max_retries' times.
+# A request not answered after 'timeout' seconds fails. If 'hedge_after' is set, a lookup not answered after that many
+# seconds is sent a second time and the first answer is used (0 = never)
+UMBRELLA_LIMITS = {'requests_per_second': 10, 'requests_per_day': 0, 'max_concurrency': 8, 'max_retries': 5,
+                   'timeout': 10, 'hedge_after': 0, 'quota_file': 'umbrella_quota.json'}
+
+# When a reputation provider fails 'failure_threshold' times in a row, no request is sent to it for 'reset_seconds'
+# (see circuit_breaker.py). Meanwhile the domains are checked with the verdicts kept in the cache, even if they have
+# expired, and the domains that have no verdict are kept in 'deferred_file' and checked on the next run. A DNS query
+# that still cannot be checked 'max_deferred_hours' after it was first deferred is dropped
+CIRCUIT_BREAKER = {'failure_threshold': 5, 'reset_seconds': 60, 'deferred_file': 'deferred_domains.ndjson',
+                   'max_deferred_hours': 72}
+
 CYBERVISION = {
     "base_url" : "<insert Cyber Vision url>",
     "x-token-id": "<insert Cyber Vision token>"
@@ -35,10 +52,97 @@ IPQUALITYSCORE = {
     "base_url": "https://ipqualityscore.com/api/json/url"
 }
 
+# Providers asked in parallel about each domain pushed to CV (see reputation_engine.py). Their verdicts are merged into a
+# score from 0 (clean) to 100 (malicious), added to the event. Set 'enabled' to True once the API keys above are set.
+# A domain whose merged score is 'clean_score' or less is not pushed.
+# A verdict of at least 'short_circuit_score' with 'short_circuit_confidence' stops the other lookups
+REPUTATION_ENGINE = {
+    'enabled': False,
+    'providers': {
+        'umbrella': {'weight': 1.0, 'timeout': 10},
+        'whoisxml': {'weight': 0.5, 'timeout': 10, 'requests_per_second': 1, 'requests_per_day': 0},
+        'ipqualityscore': {'weight': 0.7, 'timeout': 10, 'requests_per_second': 1, 'requests_per_day': 0}
+    },
+    'short_circuit_score': 90, 'short_circuit_confidence': 0.8,
+    'malicious_score': 75, 'clean_score': 25
+}
+
+# Results of the WhoisXML and IPQUALITYSCORE checks are kept in this file (see verdict_store.py). A domain checked less
+# than 'max_age_hours' ago is not requested again
+VERDICT_STORE = {'file': 'verdicts.sqlite', 'max_age_hours': 24}
+
+# Well-known domains (and their subdomains) that are never checked against Umbrella, see allowlist.py.
+# 'file' has one domain per line, or is a "rank,domain" csv such as a list of the most popular domains. It is compiled
+# into 'compiled_file' the first time it is used and every time it changes. Disabled by default: review the list before
+# enabling it, a malicious subdomain of an allowed domain is never checked
+ALLOWLIST = {'enabled': False, 'file': 'allowlist.txt', 'compiled_file': 'allowlist.bin'}
+
+# Set 'registrable_domain' to True to check the reputation of each domain by its registrable domain (e.g. example.co.uk for
+# cdn3.images.example.co.uk), so the subdomains of a site are checked and cached only once. The events pushed to CV keep
+# the full domain. 'suffix_file' is a Public Suffix List file, the copy in public_suffix_list.dat if left empty.
+# 'extra_suffix_file' adds the hosting suffixes missing from the list (public_suffix_extra.dat if not set, '' for none).
+# A domain whose suffix is in neither file is checked on its own
+DOMAIN_NORMALIZATION = {'registrable_domain': False, 'suffix_file': ''}
+
+# Database of the malicious domains that have been queried (see domains_store.py). The first time it is used, the
+# content of 'json_file' (the domains DB of previous versions) is copied into it.
+# Only the last 'keep_queries' queries of each domain are kept, the older ones are summed up in daily counts
+# 'backend' is 'sqlite' (the 'file' above) or 'log': a snapshot and append-only segments in the 'log_dir' directory,
+# folded into a new snapshot every 'compact_records' changes (see domains_log.py). Changing the backend starts a new DB
+# from 'json_file'
+DOMAINS_STORE = {'file': 'domains_DB.sqlite', 'json_file': 'domains_DB.json', 'keep_queries': 100, 'mmap_mb': 256,
+                 'backend': 'sqlite', 'log_dir': 'domains_DB.log', 'compact_records': 100000}
+
 #ONLY CHECK FLOWS SEEN IN THE LAST X DAYS. eg, ( PERIOD = {'period':7})
 # TYPE IN X AS AN INTEGER VALUE TO THE KEY 'period
 #LEAVE THIS BLANK IF YOU'RE RUNNING THE SCRIPT FOR THE FIRST TIME OR IF YOU WANT TO RETRIEVE ALL DOMAINS SEEN IN CV
 PERIOD = {'period':170}
 
-# Time (in days) that needs to pass to push into CV a domain that has already been queried
+# Time (in days) that needs to pass to push into CV a domain that has already been pushed. It is counted from the last
+# time the domain was pushed (until now, from the last time it was queried, so a domain queried every day was never
+# pushed again)
 time_between_queries = 7
+
+# Number of API requests sent to Cyber Vision at the same time when retrieving flows
+CONCURRENCY = {'workers': 8}
+
+# File where the flow scan saves the latest flow it has retrieved, so the next run only asks for newer flows.
+# DELETE THIS FILE TO RETRIEVE ALL DOMAINS AGAIN. 'overlap_minutes' re-checks flows reported late by the sensors
+CURSOR = {'file': 'retrieve_urls_cursor.json', 'overlap_minutes': 60}
+
+# Format of domains_urls.json: 'ndjson' (one domain per line, appended as they are retrieved)
+# or 'json' (a single list, as in previous versions)
+OUTPUT = {'format': 'ndjson'}
+
+# Events pushed into Cyber Vision at the same time by 'workers' threads (keep it under HTTP 'pool_size'). An event that
+# could not be sent because CV could not be connected to is sent again up to 'max_retries' times, waiting
+# 'backoff_factor' seconds (doubled on each retry). 429 answers are retried as set in HTTP, other failures are not
+# retried so that an event is never shown twice. If 'coalesce'
+# is True, the queries of a domain in a run are pushed in a single event, up to 'max_findings' queries per event
+EVENT_PUSH = {'workers': 4, 'max_retries': 3, 'backoff_factor': 1, 'coalesce': True, 'max_findings': 20}
+
+# Connections to the Cyber Vision API are kept open and shared by all the scripts.
+# Calls answered with 429 or 5xx errors are retried up to 'max_retries' times, waiting 'backoff_factor' seconds
+# (doubled on each retry) unless the server says how long to wait. 'timeout' is in seconds
+HTTP = {'pool_size': 10, 'timeout': 30, 'max_retries': 5, 'backoff_factor': 0.5}
+
+# Details of the flows already retrieved from Cyber Vision are kept in this file and not requested again.
+# When it holds more than 'max_entries' flows, the ones not used for the longest time are removed
+FLOW_CACHE = {'file': 'flow_cache.sqlite', 'max_entries': 500000}
+
+# The flows are scanned once for both TASK_1_1 ('dns') and TASK_1_2 ('ips'). The results wait in a file until the
+# task that needs them runs, remove from 'outputs' a task you never run. A task reuses the results of a scan
+# made less than 'max_age_minutes' ago instead of scanning again.
+# 'ips_mode' is 'new' to check only the public IPs of the flows that appeared since the previous scan (an IP of a
+# long-lived flow is checked once), or 'period' to check the IPs of all the flows of PERIOD on every TASK_1_2 run
+SCAN = {'outputs': ['dns', 'ips'], 'max_age_minutes': 60, 'ips_mode': 'new'}
+
+# Umbrella answers are kept in this file so the same domain is not checked again and again.
+# How long (in hours) an answer is kept depends on its verdict
+REPUTATION_CACHE = {'file': 'reputation_cache.sqlite', 'memory_entries': 10000,
+                    'ttl_clean_hours': 168, 'ttl_malicious_hours': 24, 'ttl_unknown_hours': 6}
+
+# Domains that Umbrella has seen on each public IP (TASK_1_2) are kept in the same file, so an IP is not looked up
+# again until its answer expires. IPs with no domains are kept too, for 'ttl_empty_hours'
+IP_DOMAINS_CACHE = {'file': 'reputation_cache.sqlite', 'memory_entries': 10000,
+                    'ttl_hours': 24, 'ttl_empty_hours': 72}